@@ -49,8 +49,8 @@ AbstractWidget {
         return onNormalBackground ? Appearance.colors.colOnLayer0 : adaptiveColor;
     }
 
-    property bool wallpaperIsVideo: Config.options.background.wallpaperPath.endsWith(".mp4") || Config.options.background.wallpaperPath.endsWith(".webm") || Config.options.background.wallpaperPath.endsWith(".mkv") || Config.options.background.wallpaperPath.endsWith(".avi") || Config.options.background.wallpaperPath.endsWith(".mov")
-    property string wallpaperPath: wallpaperIsVideo ? Config.options.background.thumbnailPath : Config.options.background.wallpaperPath
+    // least_busy_region.py samples video wallpapers over time itself, so no need for the first-frame thumbnail
+    property string wallpaperPath: Config.options.background.wallpaperPath
     
     onWallpaperPathChanged: refreshPlacementIfNeeded()
     onPlacementStrategyChanged: refreshPlacementIfNeeded()
@@ -68,11 +68,22 @@ AbstractWidget {
     Process {
         id: leastBusyRegionProc
         property string wallpaperPath: root.wallpaperPath
-        // TODO: make these less arbitrary
         property int contentWidth: 300
         property int contentHeight: 300
-        property int horizontalPadding: 200
-        property int verticalPadding: 200
+        property int horizontalPadding: 50
+        property int verticalPadding: 50
+        // Keep clear of the bar, in the script's (wallpaper) coordinates
+        property string barExclusion: {
+            if (Config.options.bar.autoHide.enable) return "";
+            const w = Math.round(root.scaledScreenWidth);
+            const h = Math.round(root.scaledScreenHeight);
+            if (Config.options.bar.vertical) {
+                const size = Math.ceil(Appearance.sizes.verticalBarWidth / root.wallpaperScale);
+                return `${Config.options.bar.bottom ? w - size : 0},0,${size},${h}`;
+            }
+            const size = Math.ceil(Appearance.sizes.barHeight / root.wallpaperScale);
+            return `0,${Config.options.bar.bottom ? h - size : 0},${w},${size}`;
+        }
         command: [Quickshell.shellPath("scripts/images/least-busy-region-venv.sh") // Comments to force the formatter to break lines
             , "--screen-width", Math.round(root.scaledScreenWidth) //
             , "--screen-height", Math.round(root.scaledScreenHeight) //
@@ -80,6 +91,8 @@ AbstractWidget {
             , "--height", contentHeight //
             , "--horizontal-padding", horizontalPadding //
             , "--vertical-padding", verticalPadding //
+            , ...(barExclusion.length > 0 ? ["--exclude", barExclusion] : [])
+            , "--search-strategy", "coarse-to-fine" //
             , wallpaperPath //
             , ...(root.placementStrategy === "mostBusy" ? ["--busiest"] : [])
             // "--visual-output",
@@ -91,6 +104,7 @@ AbstractWidget {
                 // console.log("[Background] Least busy region output:", output)
                 if (output.length === 0) return;
                 const parsedContent = JSON.parse(output);
+                if (parsedContent.error) return;
                 root.dominantColor = parsedContent.dominant_color || Appearance.colors.colPrimary;
                 if (root.placementStrategy === "free") return;
                 root.targetX = parsedContent.center_x * root.wallpaperScale - root.width / 2;
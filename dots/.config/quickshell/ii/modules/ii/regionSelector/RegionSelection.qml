@@ -182,7 +182,7 @@ PanelWindow {
         screenshotDir: root.screenshotDir
         screenshotPath: root.screenshotPath
         onExited: (exitCode, exitStatus) => {
-            if (root.enableContentRegions) imageDetectionProcess.running = true;
+            if (root.enableContentRegions) cursorPosProc.running = true;
             root.preparationDone = !checkRecordingProc.running;
         }
     }
@@ -208,19 +208,49 @@ PanelWindow {
         root.visible = true;
     }
 
+    // Cursor position on this screen when detection starts, "" if it's elsewhere
+    property string detectionCursor: ""
+    Process {
+        id: cursorPosProc
+        command: ["hyprctl", "cursorpos"]
+        stdout: StdioCollector {
+            onStreamFinished: {
+                // The overlay isn't hovered yet, so ask Hyprland; output is "x, y" in global coordinates
+                const x = parseInt(text.split(",")[0]) - root.monitorOffsetX;
+                const y = parseInt(text.split(",")[1]) - root.monitorOffsetY;
+                const onScreen = x >= 0 && y >= 0 && x < root.screen.width && y < root.screen.height;
+                // The screenshot is in physical pixels
+                root.detectionCursor = onScreen ? `${Math.round(x * root.monitorScale)},${Math.round(y * root.monitorScale)}` : "";
+                imageDetectionProcess.running = true;
+            }
+        }
+    }
+
     Process {
         id: imageDetectionProcess
         command: ["bash", "-c", `${Directories.scriptPath}/images/find-regions-venv.sh ` 
             + `--hyprctl ` 
+            + `--engine contours ` 
             + `--image '${StringUtils.shellSingleQuoteEscape(root.screenshotPath)}' ` 
             + `--max-width ${Math.round(root.screen.width * root.falsePositivePreventionRatio)} ` 
-            + `--max-height ${Math.round(root.screen.height * root.falsePositivePreventionRatio)} `]
-        stdout: StdioCollector {
-            id: imageDimensionCollector
-            onStreamFinished: {
-                imageRegions = RegionFunctions.filterImageRegions(
-                    JSON.parse(imageDimensionCollector.text),
-                    root.windowRegions
+            + `--max-height ${Math.round(root.screen.height * root.falsePositivePreventionRatio)} ` 
+            + `--windows - ` 
+            + `--stream ` 
+            + (root.detectionCursor !== "" ? `--cursor ${root.detectionCursor}` : "")]
+        stdinEnabled: true
+        onRunningChanged: {
+            if (!running) return;
+            // Windows are segmented separately and window duplicates dropped by the script.
+            // Scaled to the physical pixels of the screenshot.
+            const scaled = v => v.map(n => Math.round(n * root.monitorScale));
+            imageDetectionProcess.write(JSON.stringify(root.windowRegions.map(w => ({ at: scaled(w.at), size: scaled(w.size) }))));
+            stdinEnabled = false; // End input stream
+        }
+        stdout: SplitParser {
+            // One line per pass, each a complete set that replaces the previous one
+            onRead: data => {
+                imageRegions = RegionFunctions.filterOverlappingImageRegions(
+                    JSON.parse(data).regions
                 );
             }
         }
@@ -2,6 +2,7 @@
 import argparse
 import math
 import json
+import os
 from PIL import Image
 from materialyoucolor.quantize import QuantizeCelebi
 from materialyoucolor.score.score import Score
@@ -10,23 +11,6 @@ from materialyoucolor.dynamiccolor.material_dynamic_colors import MaterialDynami
 from materialyoucolor.utils.color_utils import (rgba_from_argb, argb_from_rgb, argb_from_rgba)
 from materialyoucolor.utils.math_utils import (sanitize_degrees_double, difference_degrees, rotation_direction)
 
-parser = argparse.ArgumentParser(description='Color generation script')
-parser.add_argument('--path', type=str, default=None, help='generate colorscheme from image')
-parser.add_argument('--size', type=int , default=128 , help='bitmap image size')
-parser.add_argument('--color', type=str, default=None, help='generate colorscheme from color')
-parser.add_argument('--mode', type=str, choices=['dark', 'light'], default='dark', help='dark or light mode')
-parser.add_argument('--scheme', type=str, default='vibrant', help='material scheme to use')
-parser.add_argument('--smart', action='store_true', default=False, help='decide scheme type based on image color')
-parser.add_argument('--transparency', type=str, choices=['opaque', 'transparent'], default='opaque', help='enable transparency')
-parser.add_argument('--termscheme', type=str, default=None, help='JSON file containg the terminal scheme for generating term colors')
-parser.add_argument('--harmony', type=float , default=0.8, help='(0-1) Color hue shift towards accent')
-parser.add_argument('--harmonize_threshold', type=float , default=100, help='(0-180) Max threshold angle to limit color hue shift')
-parser.add_argument('--term_fg_boost', type=float , default=0.35, help='Make terminal foreground more different from the background')
-parser.add_argument('--blend_bg_fg', action='store_true', default=False, help='Shift terminal background or foreground towards accent')
-parser.add_argument('--cache', type=str, default=None, help='file path to store the generated color')
-parser.add_argument('--debug', action='store_true', default=False, help='debug mode')
-args = parser.parse_args()
-
 rgba_to_hex = lambda rgba: "#{:02X}{:02X}{:02X}".format(rgba[0], rgba[1], rgba[2])
 argb_to_hex = lambda argb: "#{:02X}{:02X}{:02X}".format(*map(round, rgba_from_argb(argb)))
 hex_to_argb = lambda hex_code: argb_from_rgb(int(hex_code[1:3], 16), int(hex_code[3:5], 16), int(hex_code[5:], 16))
@@ -58,11 +42,60 @@ def boost_chroma_tone (argb: int, chroma: float = 1, tone: float = 1) -> int:
     hct = Hct.from_int(argb)
     return Hct.from_hct(hct.hue, hct.chroma * chroma, hct.tone * tone).to_int()
 
-darkmode = (args.mode == 'dark')
-transparent = (args.transparency == 'transparent')
-
-if args.path is not None:
-    image = Image.open(args.path)
+def quantize_cache_file():
+    cache_home = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(cache_home, 'quickshell', 'generate_colors_material', 'quantize.json')
+
+def quantize_cache_key(path, size):
+    # Identify the image by path, size and mtime, plus the bitmap size that
+    # changes what gets quantized. Returns None if the file can't be stat'ed.
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return json.dumps([os.path.realpath(path), st.st_size, st.st_mtime_ns, size])
+
+def quantize_cache_read():
+    try:
+        with open(quantize_cache_file(), 'r') as f:
+            entries = json.load(f)
+        return entries if isinstance(entries, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def quantize_cache_write(entries):
+    path = quantize_cache_file()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+def quantize_cache_load(key):
+    entries = quantize_cache_read()
+    ranked = entries.pop(key, None)
+    if not isinstance(ranked, list) or len(ranked) == 0:
+        return None
+    # Move to the end to mark as most recently used
+    entries[key] = ranked
+    quantize_cache_write(entries)
+    return ranked
+
+def quantize_cache_store(key, ranked, max_entries):
+    entries = quantize_cache_read()
+    entries.pop(key, None)
+    entries[key] = ranked
+    # Dicts keep insertion order, so the least recently used entries come first
+    while len(entries) > max(0, max_entries):
+        del entries[next(iter(entries))]
+    quantize_cache_write(entries)
+
+def quantize_image(path, size):
+    # Score-ranked seed candidates of the image, best first
+    image = Image.open(path)
 
     if image.format == "GIF":
         image.seek(1)
@@ -70,112 +103,150 @@ if args.path is not None:
     if image.mode in ["L", "P"]:
         image = image.convert('RGB')
     wsize, hsize = image.size
-    wsize_new, hsize_new = calculate_optimal_size(wsize, hsize, args.size)
+    wsize_new, hsize_new = calculate_optimal_size(wsize, hsize, size)
     if wsize_new < wsize or hsize_new < hsize:
         image = image.resize((wsize_new, hsize_new), Image.Resampling.BICUBIC)
     colors = QuantizeCelebi(list(image.getdata()), 128)
-    argb = Score.score(colors)[0]
-
-    if args.cache is not None:
-        with open(args.cache, 'w') as file:
-            file.write(argb_to_hex(argb))
-    hct = Hct.from_int(argb)
-    if(args.smart):
-        if(hct.chroma < 20):
-            args.scheme = 'neutral'
-elif args.color is not None:
-    argb = hex_to_argb(args.color)
-    hct = Hct.from_int(argb)
+    return Score.score(colors)
+
+def main():
+    parser = argparse.ArgumentParser(description='Color generation script')
+    parser.add_argument('--path', type=str, default=None, help='generate colorscheme from image')
+    parser.add_argument('--size', type=int , default=128 , help='bitmap image size')
+    parser.add_argument('--color', type=str, default=None, help='generate colorscheme from color')
+    parser.add_argument('--mode', type=str, choices=['dark', 'light'], default='dark', help='dark or light mode')
+    parser.add_argument('--scheme', type=str, default='vibrant', help='material scheme to use')
+    parser.add_argument('--smart', action='store_true', default=False, help='decide scheme type based on image color')
+    parser.add_argument('--transparency', type=str, choices=['opaque', 'transparent'], default='opaque', help='enable transparency')
+    parser.add_argument('--termscheme', type=str, default=None, help='JSON file containg the terminal scheme for generating term colors')
+    parser.add_argument('--harmony', type=float , default=0.8, help='(0-1) Color hue shift towards accent')
+    parser.add_argument('--harmonize_threshold', type=float , default=100, help='(0-180) Max threshold angle to limit color hue shift')
+    parser.add_argument('--term_fg_boost', type=float , default=0.35, help='Make terminal foreground more different from the background')
+    parser.add_argument('--blend_bg_fg', action='store_true', default=False, help='Shift terminal background or foreground towards accent')
+    parser.add_argument('--cache', type=str, default=None, help='file path to store the generated color')
+    parser.add_argument('--no_quantize_cache', action='store_true', default=False, help='always quantize the image instead of reusing the seed from an earlier run')
+    parser.add_argument('--quantize_cache_size', type=int, default=32, help='number of images whose quantization results are kept')
+    parser.add_argument('--debug', action='store_true', default=False, help='debug mode')
+    args = parser.parse_args()
+
+    darkmode = (args.mode == 'dark')
+    transparent = (args.transparency == 'transparent')
 
-if args.scheme == 'scheme-fruit-salad':
-    from materialyoucolor.scheme.scheme_fruit_salad import SchemeFruitSalad as Scheme
-elif args.scheme == 'scheme-expressive':
-    from materialyoucolor.scheme.scheme_expressive import SchemeExpressive as Scheme
-elif args.scheme == 'scheme-monochrome':
-    from materialyoucolor.scheme.scheme_monochrome import SchemeMonochrome as Scheme
-elif args.scheme == 'scheme-rainbow':
-    from materialyoucolor.scheme.scheme_rainbow import SchemeRainbow as Scheme
-elif args.scheme == 'scheme-tonal-spot':
-    from materialyoucolor.scheme.scheme_tonal_spot import SchemeTonalSpot as Scheme
-elif args.scheme == 'scheme-neutral':
-    from materialyoucolor.scheme.scheme_neutral import SchemeNeutral as Scheme
-elif args.scheme == 'scheme-fidelity':
-    from materialyoucolor.scheme.scheme_fidelity import SchemeFidelity as Scheme
-elif args.scheme == 'scheme-content':
-    from materialyoucolor.scheme.scheme_content import SchemeContent as Scheme
-elif args.scheme == 'scheme-vibrant':
-    from materialyoucolor.scheme.scheme_vibrant import SchemeVibrant as Scheme
-else:
-    from materialyoucolor.scheme.scheme_tonal_spot import SchemeTonalSpot as Scheme
-# Generate
-scheme = Scheme(hct, darkmode, 0.0)
-
-material_colors = {}
-term_colors = {}
-
-for color in vars(MaterialDynamicColors).keys():
-    color_name = getattr(MaterialDynamicColors, color)
-    if hasattr(color_name, "get_hct"):
-        rgba = color_name.get_hct(scheme).to_rgba()
-        material_colors[color] = rgba_to_hex(rgba)
-
-# Extended material
-if darkmode == True:
-    material_colors['success'] = '#B5CCBA'
-    material_colors['onSuccess'] = '#213528'
-    material_colors['successContainer'] = '#374B3E'
-    material_colors['onSuccessContainer'] = '#D1E9D6'
-else:
-    material_colors['success'] = '#4F6354'
-    material_colors['onSuccess'] = '#FFFFFF'
-    material_colors['successContainer'] = '#D1E8D5'
-    material_colors['onSuccessContainer'] = '#0C1F13'
-
-# Terminal Colors
-if args.termscheme is not None:
-    with open(args.termscheme, 'r') as f:
-        json_termscheme = f.read()
-    term_source_colors = json.loads(json_termscheme)['dark' if darkmode else 'light']
-
-    primary_color_argb = hex_to_argb(material_colors['primary_paletteKeyColor'])
-    for color, val in term_source_colors.items():
-        if(args.scheme == 'monochrome') :
-            term_colors[color] = val
-            continue
-        if args.blend_bg_fg and color == "term0":
-            harmonized = boost_chroma_tone(hex_to_argb(material_colors['surfaceContainerLow']), 1.2, 0.95)
-        elif args.blend_bg_fg and color == "term15":
-            harmonized = boost_chroma_tone(hex_to_argb(material_colors['onSurface']), 3, 1)
-        else:
-            harmonized = harmonize(hex_to_argb(val), primary_color_argb, args.harmonize_threshold, args.harmony)
-            harmonized = boost_chroma_tone(harmonized, 1, 1 + (args.term_fg_boost * (1 if darkmode else -1)))
-        term_colors[color] = argb_to_hex(harmonized)
-
-if args.debug == False:
-    print(f"$darkmode: {darkmode};")
-    print(f"$transparent: {transparent};")
-    for color, code in material_colors.items():
-        print(f"${color}: {code};")
-    for color, code in term_colors.items():
-        print(f"${color}: {code};")
-else:
     if args.path is not None:
-        print('\n--------------Image properties-----------------')
-        print(f"Image size: {wsize} x {hsize}")
-        print(f"Resized image: {wsize_new} x {hsize_new}")
-    print('\n---------------Selected color------------------')
-    print(f"Dark mode: {darkmode}")
-    print(f"Scheme: {args.scheme}")
-    print(f"Accent color: {display_color(rgba_from_argb(argb))} {argb_to_hex(argb)}")
-    print(f"HCT: {hct.hue:.2f}  {hct.chroma:.2f}  {hct.tone:.2f}")
-    print('\n---------------Material colors-----------------')
-    for color, code in material_colors.items():
-        rgba = rgba_from_argb(hex_to_argb(code))
-        print(f"{color.ljust(32)} : {display_color(rgba)}  {code}")
-    print('\n----------Harmonize terminal colors------------')
-    for color, code in term_colors.items():
-        rgba = rgba_from_argb(hex_to_argb(code))
-        code_source = term_source_colors[color]
-        rgba_source = rgba_from_argb(hex_to_argb(code_source))
-        print(f"{color.ljust(6)} : {display_color(rgba_source)} {code_source} --> {display_color(rgba)} {code}")
-    print('-----------------------------------------------')
+        # Mode, scheme and harmony changes reuse the quantization of the same image
+        cache_key = None if args.no_quantize_cache else quantize_cache_key(args.path, args.size)
+        ranked = quantize_cache_load(cache_key) if cache_key is not None else None
+        if ranked is None:
+            ranked = quantize_image(args.path, args.size)
+            if cache_key is not None:
+                quantize_cache_store(cache_key, ranked, args.quantize_cache_size)
+        argb = ranked[0]
+
+        if args.cache is not None:
+            with open(args.cache, 'w') as file:
+                file.write(argb_to_hex(argb))
+        hct = Hct.from_int(argb)
+        if(args.smart):
+            if(hct.chroma < 20):
+                args.scheme = 'neutral'
+    elif args.color is not None:
+        argb = hex_to_argb(args.color)
+        hct = Hct.from_int(argb)
+
+    if args.scheme == 'scheme-fruit-salad':
+        from materialyoucolor.scheme.scheme_fruit_salad import SchemeFruitSalad as Scheme
+    elif args.scheme == 'scheme-expressive':
+        from materialyoucolor.scheme.scheme_expressive import SchemeExpressive as Scheme
+    elif args.scheme == 'scheme-monochrome':
+        from materialyoucolor.scheme.scheme_monochrome import SchemeMonochrome as Scheme
+    elif args.scheme == 'scheme-rainbow':
+        from materialyoucolor.scheme.scheme_rainbow import SchemeRainbow as Scheme
+    elif args.scheme == 'scheme-tonal-spot':
+        from materialyoucolor.scheme.scheme_tonal_spot import SchemeTonalSpot as Scheme
+    elif args.scheme == 'scheme-neutral':
+        from materialyoucolor.scheme.scheme_neutral import SchemeNeutral as Scheme
+    elif args.scheme == 'scheme-fidelity':
+        from materialyoucolor.scheme.scheme_fidelity import SchemeFidelity as Scheme
+    elif args.scheme == 'scheme-content':
+        from materialyoucolor.scheme.scheme_content import SchemeContent as Scheme
+    elif args.scheme == 'scheme-vibrant':
+        from materialyoucolor.scheme.scheme_vibrant import SchemeVibrant as Scheme
+    else:
+        from materialyoucolor.scheme.scheme_tonal_spot import SchemeTonalSpot as Scheme
+    # Generate
+    scheme = Scheme(hct, darkmode, 0.0)
+
+    material_colors = {}
+    term_colors = {}
+
+    for color in vars(MaterialDynamicColors).keys():
+        color_name = getattr(MaterialDynamicColors, color)
+        if hasattr(color_name, "get_hct"):
+            rgba = color_name.get_hct(scheme).to_rgba()
+            material_colors[color] = rgba_to_hex(rgba)
+
+    # Extended material
+    if darkmode == True:
+        material_colors['success'] = '#B5CCBA'
+        material_colors['onSuccess'] = '#213528'
+        material_colors['successContainer'] = '#374B3E'
+        material_colors['onSuccessContainer'] = '#D1E9D6'
+    else:
+        material_colors['success'] = '#4F6354'
+        material_colors['onSuccess'] = '#FFFFFF'
+        material_colors['successContainer'] = '#D1E8D5'
+        material_colors['onSuccessContainer'] = '#0C1F13'
+
+    # Terminal Colors
+    if args.termscheme is not None:
+        with open(args.termscheme, 'r') as f:
+            json_termscheme = f.read()
+        term_source_colors = json.loads(json_termscheme)['dark' if darkmode else 'light']
+
+        primary_color_argb = hex_to_argb(material_colors['primary_paletteKeyColor'])
+        for color, val in term_source_colors.items():
+            if(args.scheme == 'monochrome') :
+                term_colors[color] = val
+                continue
+            if args.blend_bg_fg and color == "term0":
+                harmonized = boost_chroma_tone(hex_to_argb(material_colors['surfaceContainerLow']), 1.2, 0.95)
+            elif args.blend_bg_fg and color == "term15":
+                harmonized = boost_chroma_tone(hex_to_argb(material_colors['onSurface']), 3, 1)
+            else:
+                harmonized = harmonize(hex_to_argb(val), primary_color_argb, args.harmonize_threshold, args.harmony)
+                harmonized = boost_chroma_tone(harmonized, 1, 1 + (args.term_fg_boost * (1 if darkmode else -1)))
+            term_colors[color] = argb_to_hex(harmonized)
+
+    if args.debug == False:
+        print(f"$darkmode: {darkmode};")
+        print(f"$transparent: {transparent};")
+        for color, code in material_colors.items():
+            print(f"${color}: {code};")
+        for color, code in term_colors.items():
+            print(f"${color}: {code};")
+    else:
+        if args.path is not None:
+            print('\n--------------Image properties-----------------')
+            wsize, hsize = Image.open(args.path).size
+            wsize_new, hsize_new = calculate_optimal_size(wsize, hsize, args.size)
+            print(f"Image size: {wsize} x {hsize}")
+            print(f"Resized image: {wsize_new} x {hsize_new}")
+        print('\n---------------Selected color------------------')
+        print(f"Dark mode: {darkmode}")
+        print(f"Scheme: {args.scheme}")
+        print(f"Accent color: {display_color(rgba_from_argb(argb))} {argb_to_hex(argb)}")
+        print(f"HCT: {hct.hue:.2f}  {hct.chroma:.2f}  {hct.tone:.2f}")
+        print('\n---------------Material colors-----------------')
+        for color, code in material_colors.items():
+            rgba = rgba_from_argb(hex_to_argb(code))
+            print(f"{color.ljust(32)} : {display_color(rgba)}  {code}")
+        print('\n----------Harmonize terminal colors------------')
+        for color, code in term_colors.items():
+            rgba = rgba_from_argb(hex_to_argb(code))
+            code_source = term_source_colors[color]
+            rgba_source = rgba_from_argb(hex_to_argb(code_source))
+            print(f"{color.ljust(6)} : {display_color(rgba_source)} {code_source} --> {display_color(rgba)} {code}")
+        print('-----------------------------------------------')
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import json
 import sys
 import cv2
 import numpy as np
@@ -15,6 +16,11 @@ SCHEMES = [
     "scheme-tonal-spot"
 ]
 
+# Hue histogram bins (30 degrees each) and the luminance below which
+# the image is considered dark
+HUE_BINS = 12
+DARK_LUMINANCE = 0.5
+
 def image_colorfulness(image):
     # Based on Hasler and Süsstrunk's colorfulness metric
     (B, G, R) = cv2.split(image.astype("float"))
@@ -27,6 +33,37 @@ def image_colorfulness(image):
     colorfulness = np.sqrt(std_rg ** 2 + std_yb ** 2) + (0.3 * np.sqrt(mean_rg ** 2 + mean_yb ** 2))
     return colorfulness
 
+def image_statistics(image):
+    # Everything from one float32 view of the pixels: colorfulness as above,
+    # Rec. 709 luminance mean and RMS contrast (0-1), and a chroma-weighted
+    # hue histogram so grays don't count towards any hue
+    pixels = image.reshape(-1, 3).astype(np.float32)
+    B, G, R = pixels[:, 0], pixels[:, 1], pixels[:, 2]
+    rg = np.absolute(R - G)
+    yb = np.absolute(0.5 * (R + G) - B)
+    colorfulness = np.sqrt(rg.var() + yb.var()) + 0.3 * np.sqrt(rg.mean() ** 2 + yb.mean() ** 2)
+    luminance = (0.0722 / 255) * B + (0.7152 / 255) * G + (0.2126 / 255) * R
+    mean_luminance = float(luminance.mean())
+    high = np.maximum(np.maximum(R, G), B)
+    chroma = high - np.minimum(np.minimum(R, G), B)
+    safe_chroma = np.where(chroma > 0, chroma, 1)
+    hue = np.where(high == R, (G - B) / safe_chroma,
+          np.where(high == G, (B - R) / safe_chroma + 2, (R - G) / safe_chroma + 4))
+    hue = (hue * 60) % 360
+    histogram = np.bincount((hue * (HUE_BINS / 360)).astype(np.intp) % HUE_BINS, weights=chroma, minlength=HUE_BINS)
+    total = histogram.sum()
+    if total > 0:
+        histogram /= total
+    return {
+        "colorfulness": float(colorfulness),
+        "scheme": pick_scheme(colorfulness),
+        "mean_luminance": round(mean_luminance, 4),
+        "contrast": round(float(luminance.std()), 4),
+        "hue_histogram": [round(float(v), 4) for v in histogram],
+        "dominant_hue": int(np.argmax(histogram)) * (360 // HUE_BINS) + 180 // HUE_BINS if total > 0 else None,
+        "mode": "dark" if mean_luminance < DARK_LUMINANCE else "light",
+    }
+
 # scheme-content respects the image's colors very well, but it might
 # look too saturated, so we only use it for not very colorful images to be safe
 def pick_scheme(colorfulness):
@@ -47,10 +84,14 @@ def load_and_resize_image(img_path, max_dim=128):
 
 def main():
     colorfulness_mode = False
+    json_mode = False
     args = sys.argv[1:]
     if '--colorfulness' in args:
         colorfulness_mode = True
         args.remove('--colorfulness')
+    if '--json' in args:
+        json_mode = True
+        args.remove('--json')
     if len(args) < 1:
         print("scheme-tonal-spot")
         sys.exit(1)
@@ -59,6 +100,9 @@ def main():
     if img is None:
         print("scheme-tonal-spot")
         sys.exit(1)
+    if json_mode:
+        print(json.dumps(image_statistics(img)))
+        return
     colorfulness = image_colorfulness(img)
     if colorfulness_mode:
         print(f"{colorfulness}")
@@ -106,6 +106,14 @@ RESTORE_SCRIPT="$RESTORE_SCRIPT_DIR/__restore_video_wallpaper.sh"
 THUMBNAIL_DIR="$RESTORE_SCRIPT_DIR/mpvpaper_thumbnails"
 VIDEO_OPTS="no-audio loop hwdec=auto scale=bilinear interpolation=no video-sync=display-resample panscan=1.0 video-scale-x=1.0 video-scale-y=1.0 video-align-x=0.5 video-align-y=0.5 load-scripts=no"
 
+indexed_value() {
+    # Print a field of the image's wallpaper_index.py entry, or nothing if
+    # the image isn't indexed or changed since
+    local img="$1" field="$2"
+    [[ -f "$CACHE_DIR/wallpaper_index.json" ]] || return
+    "$SCRIPT_DIR"/wallpaper_index.py --lookup "$img" 2>/dev/null | jq -r --arg field "$field" '.[$field] // empty' 2>/dev/null
+}
+
 is_video() {
     local extension="${1##*.}"
     [[ "$extension" == "mp4" || "$extension" == "webm" || "$extension" == "mkv" || "$extension" == "avi" || "$extension" == "mov" ]] && return 0 || return 1
@@ -161,6 +169,7 @@ switch() {
     type_flag="$3"
     color_flag="$4"
     color="$5"
+    indexed_seed=""
 
     # Start Gemini auto-categorization if enabled
     aiStylingEnabled=$(jq -r '.background.clock.cookie.aiStyling' "$SHELL_CONFIG_FILE")
@@ -245,6 +254,11 @@ switch() {
         else
             matugen_args=(image "$imgpath")
             generate_colors_material_args=(--path "$imgpath")
+            # Reuse the seed color from the wallpaper index if it's up to date
+            indexed_seed="$(indexed_value "$imgpath" seed)"
+            if [[ -n "$indexed_seed" ]]; then
+                generate_colors_material_args=(--color "$indexed_seed")
+            fi
             # Update wallpaper path in config
             set_wallpaper_path "$imgpath"
             remove_restore
@@ -285,6 +299,12 @@ switch() {
         fi
     fi
 
+    # --cache only records seeds picked from an image, so store the indexed one here
+    if [[ -n "$indexed_seed" ]]; then
+        mkdir -p "$STATE_DIR/user/generated"
+        echo -n "$indexed_seed" > "$STATE_DIR/user/generated/color.txt"
+    fi
+
     # Set harmony and related properties
     if [ -f "$SHELL_CONFIG_FILE" ]; then
         harmony=$(jq -r '.appearance.wallpaperTheming.terminalGenerationProps.harmony' "$SHELL_CONFIG_FILE")
@@ -329,6 +349,12 @@ main() {
 
     detect_scheme_type_from_image() {
         local img="$1"
+        local indexed_scheme
+        indexed_scheme="$(indexed_value "$img" scheme)"
+        if [[ -n "$indexed_scheme" ]]; then
+            echo -n "$indexed_scheme"
+            return
+        fi
         source "$(eval echo $ILLOGICAL_IMPULSE_VIRTUAL_ENV)/bin/activate"
         "$SCRIPT_DIR"/scheme_for_image.py "$img" 2>/dev/null | tr -d '\n'
         deactivate
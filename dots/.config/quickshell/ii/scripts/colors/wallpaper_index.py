@@ -0,0 +1,144 @@
+#!/usr/bin/env -S\_/bin/sh\_-c\_"source\_\$(eval\_echo\_\$ILLOGICAL_IMPULSE_VIRTUAL_ENV)/bin/activate&&exec\_python\_-E\_"\$0"\_"\$@""
+# Indexes the colors of a wallpaper directory so switching and the picker
+# don't need to analyze images one process at a time. Per image it stores
+# what scheme_for_image.py and generate_colors_material.py would compute:
+# the colorfulness, the auto scheme, the Score-ranked seed color and the
+# image dimensions. Entries are keyed by path and reused while the file's
+# size and mtime are unchanged.
+import argparse
+import json
+import os
+import sys
+from multiprocessing import Pool
+
+INDEX_VERSION = 1
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".avif", ".bmp", ".gif"}
+
+def index_file():
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(cache_home, "quickshell", "wallpaper_index.json")
+
+def read_index(path):
+    try:
+        with open(path, "r") as f:
+            index = json.load(f)
+        if isinstance(index, dict) and index.get("version") == INDEX_VERSION and isinstance(index.get("entries"), dict):
+            return index
+    except (OSError, ValueError):
+        pass
+    return {"version": INDEX_VERSION, "entries": {}}
+
+def write_index(path, index):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+def file_identity(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def is_fresh(entry, identity):
+    return entry is not None and identity is not None and entry.get("size") == identity["size"] and entry.get("mtime_ns") == identity["mtime_ns"]
+
+def analyze_image(task):
+    # Imported here so --lookup doesn't pay for them
+    from PIL import Image
+    import generate_colors_material
+    import scheme_for_image
+
+    path, identity, bitmap_size = task
+    entry = dict(identity)
+    try:
+        # Same steps as generate_colors_material.py --path
+        with Image.open(path) as image:
+            entry["width"], entry["height"] = image.size
+        argb = generate_colors_material.quantize_image(path, bitmap_size)[0]
+        entry["seed"] = generate_colors_material.argb_to_hex(argb)
+
+        # Same steps as scheme_for_image.py
+        img = scheme_for_image.load_and_resize_image(path)
+        if img is not None:
+            colorfulness = scheme_for_image.image_colorfulness(img)
+            entry["colorfulness"] = round(float(colorfulness), 4)
+            entry["scheme"] = scheme_for_image.pick_scheme(colorfulness)
+    except Exception as e:
+        # Remembered too, so a broken file isn't retried on every run
+        entry["error"] = str(e)
+    return path, entry
+
+def list_images(directory, recursive):
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in files if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+        if not recursive:
+            break
+    return sorted(os.path.realpath(p) for p in paths)
+
+def update_index(index, directories, recursive, jobs, bitmap_size, machine_progress):
+    # Returns the number of entries added, refreshed or removed
+    entries = index["entries"]
+    tasks = []
+    removed = 0
+    for directory in directories:
+        directory = os.path.realpath(directory)
+        images = list_images(directory, recursive)
+        present = set(images)
+        # Forget images that were deleted from the directory
+        prefix = os.path.join(directory, "")
+        for path in [p for p in entries if p.startswith(prefix) and p not in present]:
+            if recursive or os.path.dirname(path) == directory:
+                del entries[path]
+                removed += 1
+        for path in images:
+            identity = file_identity(path)
+            if identity is not None and not is_fresh(entries.get(path), identity):
+                tasks.append((path, identity, bitmap_size))
+
+    total = len(tasks)
+    if total == 0:
+        return removed
+    with Pool(processes=min(jobs, total)) as p:
+        for completed, (path, entry) in enumerate(p.imap_unordered(analyze_image, tasks), 1):
+            entries[path] = entry
+            if machine_progress:
+                print(f"PROGRESS {completed}/{total} FILE {path}")
+                sys.stdout.flush()
+    return total + removed
+
+def main():
+    parser = argparse.ArgumentParser(description="Index the colorfulness, auto scheme, seed color and size of every wallpaper in a directory.")
+    parser.add_argument("-d", "--directory", action="append", default=[], help="Wallpaper directory to index (can be repeated)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Also index subdirectories")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="Worker processes (default: CPU count)")
+    parser.add_argument("--size", type=int, default=128, help="Bitmap size for the seed color, as in generate_colors_material.py")
+    parser.add_argument("--index", default=index_file(), help="Index file (default: $XDG_CACHE_HOME/quickshell/wallpaper_index.json)")
+    parser.add_argument("--lookup", metavar="IMAGE", help="Print the entry for IMAGE if it's indexed and unchanged, otherwise exit with 1")
+    parser.add_argument("--machine_progress", action="store_true", help="Print PROGRESS n/total FILE path lines, like thumbgen.py")
+    args = parser.parse_args()
+
+    index = read_index(args.index)
+    if args.lookup:
+        path = os.path.realpath(args.lookup)
+        entry = index["entries"].get(path)
+        if not is_fresh(entry, file_identity(path)) or "error" in entry:
+            sys.exit(1)
+        print(json.dumps(entry))
+        return
+
+    if not args.directory:
+        parser.error("nothing to do, pass --directory or --lookup")
+    # Worker processes import scheme_for_image and generate_colors_material from next to this script
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    if update_index(index, args.directory, args.recursive, max(1, args.jobs), args.size, args.machine_progress) > 0:
+        write_index(args.index, index)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# Compact, memory-mappable busyness map of a wallpaper, as exported by
+# least_busy_region.py --export-map. Querying only needs the standard library,
+# so it starts fast and answers in microseconds without decoding anything.
+#
+# File layout (little endian):
+#   header: magic (8 bytes), width, height, block, cols, rows (uint32 each)
+#   sums:    (rows + 1) x (cols + 1) uint64 integral image of the grayscale values
+#   squares: (rows + 1) x (cols + 1) uint64 integral image of their squares
+# Both integral images are over block x block pixel cells, so rectangles are
+# snapped to the block grid. A block of 1 gives exact per-pixel answers.
+
+import argparse
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+
+MAGIC = b"LBRMAP1\0"
+HEADER = struct.Struct("<8s5I")
+CELL = struct.Struct("<Q")
+DEFAULT_BLOCK = 4
+
+def write_busyness_map(path, gray, block=DEFAULT_BLOCK):
+    import numpy as np
+    block = max(1, int(block))
+    h, w = gray.shape
+    rows, cols = math.ceil(h / block), math.ceil(w / block)
+    values = gray.astype(np.uint64)
+    row_starts, col_starts = np.arange(0, h, block), np.arange(0, w, block)
+    tables = []
+    for data in (values, values * values):
+        cells = np.add.reduceat(np.add.reduceat(data, row_starts, axis=0), col_starts, axis=1)
+        table = np.zeros((rows + 1, cols + 1), dtype="<u8")
+        table[1:, 1:] = cells.cumsum(axis=0).cumsum(axis=1)
+        tables.append(table)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, w, h, block, cols, rows))
+        for table in tables:
+            f.write(table.tobytes())
+    os.replace(tmp_path, path)
+
+class BusynessMap:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.width, self.height, self.block, self.cols, self.rows = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError(f"Not a busyness map: {path}")
+        self._stride = self.cols + 1
+        self._sums = HEADER.size
+        self._squares = self._sums + (self.rows + 1) * self._stride * CELL.size
+
+    def close(self):
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _rect_sum(self, table, c1, r1, c2, r2):
+        at = lambda r, c: CELL.unpack_from(self._mm, table + (r * self._stride + c) * CELL.size)[0]
+        return at(r2, c2) - at(r2, c1) - at(r1, c2) + at(r1, c1)
+
+    def query(self, x, y, w, h):
+        # Mean and variance of the rectangle, snapped to the nearest block
+        # boundaries and clamped to the map. Coordinates are screen pixels.
+        b = self.block
+        c1 = min(max(0, round(x / b)), self.cols - 1)
+        r1 = min(max(0, round(y / b)), self.rows - 1)
+        c2 = min(max(c1 + 1, round((x + w) / b)), self.cols)
+        r2 = min(max(r1 + 1, round((y + h) / b)), self.rows)
+        px1, py1 = c1 * b, r1 * b
+        px2, py2 = min(c2 * b, self.width), min(r2 * b, self.height)
+        area = (px2 - px1) * (py2 - py1)
+        s = self._rect_sum(self._sums, c1, r1, c2, r2)
+        s2 = self._rect_sum(self._squares, c1, r1, c2, r2)
+        mean = s / area
+        return {
+            "x": px1,
+            "y": py1,
+            "width": px2 - px1,
+            "height": py2 - py1,
+            "mean": mean,
+            "variance": s2 / area - mean ** 2,
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Query a busyness map exported by least_busy_region.py --export-map.")
+    parser.add_argument("map_path", help="Path to the busyness map")
+    parser.add_argument("rect", nargs="*", type=float, help="x y width height of the region, in screen pixels")
+    parser.add_argument("--stdin", action="store_true", help="Read one 'x y width height' query per line from stdin and answer each with a JSON line")
+    args = parser.parse_args()
+    if not args.stdin and len(args.rect) != 4:
+        parser.error("expected x y width height, or --stdin")
+
+    with BusynessMap(args.map_path) as busyness:
+        if not args.stdin:
+            print(json.dumps(busyness.query(*args.rect)))
+            return
+        for line in sys.stdin:
+            parts = line.split()
+            if len(parts) != 4:
+                continue
+            print(json.dumps(busyness.query(*map(float, parts))), flush=True)
+
+if __name__ == "__main__":
+    main()
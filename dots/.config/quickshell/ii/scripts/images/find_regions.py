@@ -3,67 +3,545 @@
 import argparse
 import cv2
 import json
+import math
 import numpy as np
+import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 DEFAULT_IMAGE_PATH = '/tmp/quickshell/media/screenshot/image'
+# Contour engine: Canny thresholds and the closing kernel size in pixels
+CONTOUR_CANNY_LOW = 20
+CONTOUR_CANNY_HIGH = 60
+CONTOUR_CLOSE_SIZE = 3
+# Regions overlapping a window more than this are the window itself, same as
+# RegionFunctions.filterImageRegions
+WINDOW_IOU_THRESHOLD = 0.1
+# Streaming: resolution of the first pass relative to the normal one, and the
+# overlap at which a refined region keeps the ID of the one it replaces
+STREAM_PREVIEW_SCALE = 0.5
+STREAM_MATCH_IOU = 0.5
+DEFAULT_RESIZE_FACTOR = 0.1
+# Time budget mode: range of resize factors to pick from, size of the
+# calibration run when there is no measurement yet, and how much slower
+# quality mode is assumed to be until it has been measured
+BUDGET_RESIZE_RANGE = (0.03, 0.5)
+QUALITY_SLOWDOWN = 4.0
+# Timings kept per strategy for the cost model, and how far one run can move
+# the predicted time of a pass (as a factor)
+CALIBRATION_SAMPLES = 8
+CALIBRATION_STEP_LIMIT = 2.0
+# Tiled selective search: overlap between tiles as a fraction of the tile
+# size (at least TILE_MIN_OVERLAP pixels), how close to a tile edge a region
+# must end to count as cut by it, and how well two halves must line up
+TILE_OVERLAP = 0.1
+TILE_MIN_OVERLAP = 8
+TILE_SEAM_MARGIN = 2
+TILE_SEAM_IOU = 0.7
+# Raw input formats as (channel order, bytes per pixel); x is padding
+RAW_FORMATS = {
+    'bgrx': ('bgra', 4),
+    'bgra': ('bgra', 4),
+    'rgbx': ('rgba', 4),
+    'rgba': ('rgba', 4),
+    'bgr': ('bgr', 3),
+    'rgb': ('rgb', 3),
+    'gray': ('gray', 1),
+}
+NETPBM_DEPTH_ORDERS = {1: 'gray', 3: 'rgb', 4: 'rgba'}
+PIXEL_CONVERSIONS = {
+    ('rgb', 'bgr'): cv2.COLOR_RGB2BGR,
+    ('bgra', 'bgr'): cv2.COLOR_BGRA2BGR,
+    ('rgba', 'bgr'): cv2.COLOR_RGBA2BGR,
+    ('gray', 'bgr'): cv2.COLOR_GRAY2BGR,
+    ('bgr', 'gray'): cv2.COLOR_BGR2GRAY,
+    ('rgb', 'gray'): cv2.COLOR_RGB2GRAY,
+    ('bgra', 'gray'): cv2.COLOR_BGRA2GRAY,
+    ('rgba', 'gray'): cv2.COLOR_RGBA2GRAY,
+}
 
-def iou(boxA, boxB):
-    # Compute intersection over union for two boxes
-    xA = max(boxA['x'], boxB['x'])
-    yA = max(boxA['y'], boxB['y'])
-    xB = min(boxA['x'] + boxA['width'], boxB['x'] + boxB['width'])
-    yB = min(boxA['y'] + boxA['height'], boxB['y'] + boxB['height'])
-    interW = max(0, xB - xA)
-    interH = max(0, yB - yA)
-    interArea = interW * interH
-    boxAArea = boxA['width'] * boxA['height']
-    boxBArea = boxB['width'] * boxB['height']
-    iou = interArea / float(boxAArea + boxBArea - interArea) if (boxAArea + boxBArea - interArea) > 0 else 0
-    return iou
-
-def non_max_suppression(regions, iou_threshold=0.7):
-    # Sort by area (largest first)
-    regions = sorted(regions, key=lambda r: r['width'] * r['height'], reverse=True)
+def box_iou(box, boxes):
+    # Intersection over union of one x, y, w, h box against an N x 4 array
+    xA = np.maximum(box[0], boxes[:, 0])
+    yA = np.maximum(box[1], boxes[:, 1])
+    xB = np.minimum(box[0] + box[2], boxes[:, 0] + boxes[:, 2])
+    yB = np.minimum(box[1] + box[3], boxes[:, 1] + boxes[:, 3])
+    interArea = np.maximum(0, xB - xA) * np.maximum(0, yB - yA)
+    union = box[2] * box[3] + boxes[:, 2] * boxes[:, 3] - interArea
+    return np.where(union > 0, interArea / np.maximum(union, 1), 0.0)
+
+def non_max_suppression(boxes, iou_threshold=0.7, method='numpy'):
+    # Greedy NMS over an N x 4 array of x, y, w, h boxes, largest area first.
+    # Returns the kept boxes, largest first.
+    areas = boxes[:, 2] * boxes[:, 3]
+    if method == 'opencv' and hasattr(cv2, 'dnn') and len(boxes) > 0:
+        # Same greedy pass in C++, but IoU is float32 there, so boxes right at
+        # the threshold may be decided differently
+        keep = cv2.dnn.NMSBoxes(boxes.tolist(), areas.astype(np.float32).tolist(), 0.0, iou_threshold)
+        return boxes[np.asarray(keep, dtype=np.int64).reshape(-1)]
+    order = np.argsort(-areas, kind='stable')
     keep = []
-    while regions:
-        current = regions.pop(0)
+    while order.size > 0:
+        current = order[0]
         keep.append(current)
-        regions = [r for r in regions if iou(current, r) < iou_threshold]
-    return keep
+        rest = order[1:]
+        order = rest[box_iou(boxes[current], boxes[rest]) < iou_threshold]
+    return boxes[keep]
 
-def find_regions(image_path, min_width, min_height, max_width=None, max_height=None, quality=False, k=150, min_size=20, sigma=0.8, resize_factor=1.0):
-    image = cv2.imread(image_path)
-    if image is None:
-        print(f'Error: Could not load image {image_path}', file=sys.stderr)
-        sys.exit(1)
-    orig_h, orig_w = image.shape[:2]
-    if resize_factor != 1.0:
-        image = cv2.resize(image, (int(orig_w * resize_factor), int(orig_h * resize_factor)), interpolation=cv2.INTER_AREA)
+def selective_search(image, quality=False, k=150, min_size=20, sigma=0.8):
     ss = cv2.ximgproc.segmentation.createSelectiveSearchSegmentation()
     ss.setBaseImage(image)
     if quality:
         ss.switchToSelectiveSearchQuality(k, min_size, sigma)
     else:
         ss.switchToSelectiveSearchFast(k, min_size, sigma)
-    rects = ss.process()
-    regions = []
-    for (x, y, w, h) in rects:
-        # Scale regions back to original image size if resized
-        if resize_factor != 1.0:
-            x = int(x / resize_factor)
-            y = int(y / resize_factor)
-            w = int(w / resize_factor)
-            h = int(h / resize_factor)
-        # Filter out region that is exactly the same size as the original image
-        if w == orig_w and h == orig_h and x == 0 and y == 0:
+    return ss.process().astype(np.int64).reshape(-1, 4)
+
+def selective_search_rects(image, quality=False, k=150, min_size=20, sigma=0.8, resize_factor=1.0, jobs=1):
+    # Object proposals from cv2.ximgproc selective search, as an N x 4 array
+    # of x, y, w, h in original image coordinates
+    orig_h, orig_w = image.shape[:2]
+    if resize_factor != 1.0:
+        image = cv2.resize(image, (int(orig_w * resize_factor), int(orig_h * resize_factor)), interpolation=cv2.INTER_AREA)
+    if jobs > 1:
+        rects = tiled_rects(image, jobs, lambda tile: selective_search(tile, quality, k, min_size, sigma))
+    else:
+        rects = selective_search(image, quality, k, min_size, sigma)
+    # Scale regions back to original image size if resized
+    if resize_factor != 1.0:
+        rects = (rects / resize_factor).astype(np.int64)
+    return rects
+
+def tile_grid(length, count, overlap):
+    # (start, end) of count tiles along one axis, neighbours sharing overlap pixels
+    step = (length + (count - 1) * overlap) / count
+    return [(int(i * (step - overlap)), min(length, int(i * (step - overlap) + step))) for i in range(count)]
+
+def tiled_rects(image, jobs, detect):
+    # Run detect on overlapping tiles in a thread pool (OpenCV releases the
+    # GIL), then stitch regions that a tile boundary cut in two
+    h, w = image.shape[:2]
+    rows = max(1, int(math.sqrt(jobs)))
+    cols = math.ceil(jobs / rows)
+    overlap = max(TILE_MIN_OVERLAP, int(min(h / rows, w / cols) * TILE_OVERLAP))
+    x_tiles, y_tiles = tile_grid(w, cols, overlap), tile_grid(h, rows, overlap)
+    tiles = [(x1, y1, x2, y2) for y1, y2 in y_tiles for x1, x2 in x_tiles]
+    def run(tile):
+        x1, y1, x2, y2 = tile
+        rects = detect(np.ascontiguousarray(image[y1:y2, x1:x2]))
+        rects[:, :2] += (x1, y1)
+        return rects
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        rects = np.concatenate(list(pool.map(run, tiles)))
+    # Each seam is where a tile starts inside its left or upper neighbour;
+    # the overlap band runs from there to the end of that neighbour
+    for (_, prev_end), (start, _) in zip(x_tiles, x_tiles[1:]):
+        rects = merge_across_seam(rects, start, prev_end, axis=0)
+    for (_, prev_end), (start, _) in zip(y_tiles, y_tiles[1:]):
+        rects = merge_across_seam(rects, start, prev_end, axis=1)
+    return rects
+
+def merge_across_seam(rects, band_start, band_end, axis):
+    # Regions cut by a seam show up as one region running into the overlap
+    # band from each side, with about the same extent along the seam. Replace
+    # each such pair with their union. axis 0 is a vertical seam.
+    pos, end = rects[:, axis], rects[:, axis] + rects[:, axis + 2]
+    along, along_end = rects[:, 1 - axis], rects[:, 1 - axis] + rects[:, 3 - axis]
+    # Ending at the far side of the band means the tile edge cut it
+    before = np.nonzero((pos < band_start) & (end >= band_end - TILE_SEAM_MARGIN) & (end <= band_end))[0]
+    after = np.nonzero((pos >= band_start) & (pos <= band_start + TILE_SEAM_MARGIN) & (end > band_end))[0]
+    if before.size == 0 or after.size == 0:
+        return rects
+    # How well the two line up along the seam, as a 1D IoU for every pair
+    a_lo, a_hi = along[before][:, None], along_end[before][:, None]
+    b_lo, b_hi = along[after][None, :], along_end[after][None, :]
+    inter = np.maximum(0, np.minimum(a_hi, b_hi) - np.maximum(a_lo, b_lo))
+    match = inter / np.maximum(np.maximum(a_hi, b_hi) - np.minimum(a_lo, b_lo), 1)
+    merged, used_before, used_after = [], set(), set()
+    # Best matching pairs first, each region merged at most once
+    for flat in np.argsort(-match, axis=None, kind='stable').tolist():
+        i, j = divmod(flat, after.size)
+        if match[i, j] < TILE_SEAM_IOU:
+            break
+        if i in used_before or j in used_after:
             continue
-        if w > min_width and h > min_height:
-            if (max_width is None or w < max_width) and (max_height is None or h < max_height):
-                regions.append({'x': int(x), 'y': int(y), 'width': int(w), 'height': int(h)})
+        used_before.add(i)
+        used_after.add(j)
+        a, b = rects[before[i]], rects[after[j]]
+        x1, y1 = min(a[0], b[0]), min(a[1], b[1])
+        x2, y2 = max(a[0] + a[2], b[0] + b[2]), max(a[1] + a[3], b[1] + b[3])
+        merged.append((x1, y1, x2 - x1, y2 - y1))
+    if not merged:
+        return rects
+    drop = np.zeros(len(rects), dtype=bool)
+    drop[before[sorted(used_before)]] = True
+    drop[after[sorted(used_after)]] = True
+    return np.concatenate([rects[~drop], np.array(merged, dtype=np.int64)])
+
+def contour_rects(gray, canny_low=CONTOUR_CANNY_LOW, canny_high=CONTOUR_CANNY_HIGH, close_size=CONTOUR_CLOSE_SIZE):
+    # UI elements are mostly axis-aligned boxes with a visible border or a
+    # background that differs from their surroundings. Edges, closed so that
+    # anti-aliased or dashed borders form rings, outline them directly.
+    edges = cv2.Canny(gray, canny_low, canny_high)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (close_size, close_size))
+    edges = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)
+    contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return np.zeros((0, 4), dtype=np.int64)
+    return np.array([cv2.boundingRect(c) for c in contours], dtype=np.int64)
+
+def window_boxes(windows, width, height):
+    # Window rectangles as an N x 4 array clipped to the image. Accepts
+    # hyprctl clients entries ({"at": [x, y], "size": [w, h]}) or
+    # {"x", "y", "width", "height"} objects.
+    boxes = []
+    for window in windows:
+        if 'at' in window:
+            (x, y), (w, h) = window['at'], window['size']
+        else:
+            x, y, w, h = window['x'], window['y'], window['width'], window['height']
+        x1, y1 = max(0, int(x)), max(0, int(y))
+        x2, y2 = min(width, int(x + w)), min(height, int(y + h))
+        if x2 > x1 and y2 > y1:
+            boxes.append((x1, y1, x2 - x1, y2 - y1))
+    return np.array(boxes, dtype=np.int64).reshape(-1, 4)
+
+def detect_rects(image, engine, quality=False, k=150, min_size=20, sigma=0.8, resize_factor=1.0, jobs=1):
+    if engine == 'contours':
+        # Full resolution; the whole pass is a few linear-time filters
+        return contour_rects(image)
+    return selective_search_rects(image, quality, k, min_size, sigma, resize_factor, jobs)
+
+def read_bytes(image_path):
+    if image_path == '-':
+        return sys.stdin.buffer.read()
+    with open(image_path, 'rb') as f:
+        return f.read()
+
+def wrap_raw(data, raw_format, width, height, stride=None):
+    # View an unformatted pixel buffer as an image without copying it
+    order, channels = RAW_FORMATS[raw_format]
+    stride = stride or width * channels
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if buffer.size < stride * (height - 1) + width * channels:
+        raise ValueError(f'Raw buffer too small for {width}x{height} {raw_format} with stride {stride}')
+    pixels = np.lib.stride_tricks.as_strided(buffer, shape=(height, width, channels), strides=(stride, channels, 1), writeable=False)
+    return (pixels[:, :, 0] if channels == 1 else pixels), order
+
+def parse_netpbm(data):
+    # PGM (P5), PPM (P6) or PAM (P7) with 8-bit samples, as a view of data
+    magic = data[:2]
+    if magic == b'P7':
+        header_end = data.index(b'ENDHDR\n') + len(b'ENDHDR\n')
+        fields = dict(line.split(None, 1) for line in data[3:header_end].decode().splitlines() if line and not line.startswith('#') and ' ' in line)
+        width, height, depth, maxval = (int(fields[key]) for key in ('WIDTH', 'HEIGHT', 'DEPTH', 'MAXVAL'))
+    else:
+        values, pos = [], 2
+        while len(values) < 3:
+            while data[pos:pos + 1].isspace():
+                pos += 1
+            if data[pos:pos + 1] == b'#':
+                pos = data.index(b'\n', pos)
+                continue
+            start = pos
+            while data[pos:pos + 1].isdigit():
+                pos += 1
+            values.append(int(data[start:pos]))
+        width, height, maxval = values
+        depth = 1 if magic == b'P5' else 3
+        # Exactly one whitespace character separates the header from the pixels
+        header_end = pos + 1
+    if maxval != 255 or depth not in NETPBM_DEPTH_ORDERS:
+        raise ValueError(f'Unsupported netpbm image: depth {depth}, maxval {maxval}')
+    order = NETPBM_DEPTH_ORDERS[depth]
+    pixels = np.frombuffer(data, dtype=np.uint8, count=width * height * depth, offset=header_end).reshape(height, width, depth)
+    return (pixels[:, :, 0] if depth == 1 else pixels), order
+
+def read_pixels(image_path, raw_format=None, raw_width=None, raw_height=None, raw_stride=None, gray=False):
+    # The input image and its channel order ('bgr', 'rgb', 'bgra', 'rgba' or
+    # 'gray'). Uncompressed input (raw buffers and netpbm from a pipe or fd,
+    # like grim -t ppm) is wrapped as is instead of being decoded. With gray,
+    # image files are decoded straight to grayscale.
+    try:
+        if raw_format:
+            if os.path.isfile(image_path):
+                return wrap_raw(np.memmap(image_path, dtype=np.uint8, mode='r'), raw_format, raw_width, raw_height, raw_stride)
+            return wrap_raw(read_bytes(image_path), raw_format, raw_width, raw_height, raw_stride)
+        if image_path == '-' or not os.path.isfile(image_path):
+            data = read_bytes(image_path)
+            if data[:2] in (b'P5', b'P6', b'P7'):
+                return parse_netpbm(data)
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        elif gray:
+            image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+            if image is not None:
+                return image, 'gray'
+        else:
+            image = cv2.imread(image_path)
+    except (OSError, ValueError) as e:
+        print(f'Error: Could not load image {image_path}: {e}', file=sys.stderr)
+        sys.exit(1)
+    if image is None:
+        print(f'Error: Could not load image {image_path}', file=sys.stderr)
+        sys.exit(1)
+    return image, 'bgr'
+
+def convert_pixels(pixels, order, target):
+    # target is 'bgr' or 'gray'; returns pixels itself if nothing changes
+    if order == target:
+        return pixels
+    return cv2.cvtColor(pixels, PIXEL_CONVERSIONS[(order, target)])
+
+def load_image(image_path, engine='selective-search'):
+    # The contour engine only looks at intensities
+    pixels, order = read_pixels(image_path, gray=engine == 'contours')
+    return convert_pixels(pixels, order, 'gray' if engine == 'contours' else 'bgr')
+
+def filter_rects(rects, width, height, min_width, min_height, max_width=None, max_height=None, nms='numpy', windows=None):
+    x, y, w, h = rects.T
+    # Filter out region that is exactly the same size as the original image
+    keep = ~((w == width) & (h == height) & (x == 0) & (y == 0))
+    keep &= (w > min_width) & (h > min_height)
+    if max_width is not None:
+        keep &= w < max_width
+    if max_height is not None:
+        keep &= h < max_height
+    rects = rects[keep]
+    # Drop regions that are just a window
+    if windows is not None:
+        for window in windows:
+            rects = rects[box_iou(window, rects) <= WINDOW_IOU_THRESHOLD]
     # Remove duplicates/overlaps
-    regions = non_max_suppression(regions, iou_threshold=0.7)
-    return regions, cv2.imread(image_path)  # Return original image for drawing
+    return non_max_suppression(rects, iou_threshold=0.7, method=nms)
+
+def detect_regions(image, min_width, min_height, max_width=None, max_height=None, quality=False, k=150, min_size=20, sigma=0.8, resize_factor=1.0, nms='numpy', engine='selective-search', windows=None, jobs=1):
+    # Regions of an already loaded image as an N x 4 array, largest first
+    orig_h, orig_w = image.shape[:2]
+    detect = lambda img: detect_rects(img, engine, quality, k, min_size, sigma, resize_factor, jobs)
+    if windows is None:
+        rects = detect(image)
+    else:
+        windows = window_boxes(windows, orig_w, orig_h)
+        rects = window_aware_rects(image, windows, detect, min_width, min_height)
+    return filter_rects(rects, orig_w, orig_h, min_width, min_height, max_width, max_height, nms, windows)
+
+def find_regions(image_path, min_width, min_height, max_width=None, max_height=None, quality=False, k=150, min_size=20, sigma=0.8, resize_factor=1.0, nms='numpy', engine='selective-search', windows=None, jobs=1):
+    image = load_image(image_path, engine)
+    boxes = detect_regions(image, min_width, min_height, max_width, max_height, quality, k, min_size, sigma, resize_factor, nms, engine, windows, jobs)
+    return [{'x': x, 'y': y, 'width': w, 'height': h} for x, y, w, h in boxes.tolist()]
+
+def preview_regions(image, min_width, min_height, max_width=None, max_height=None, quality=False, k=150, min_size=20, sigma=0.8, resize_factor=1.0, nms='numpy', engine='selective-search', windows=None, jobs=1, cursor=None, scale=STREAM_PREVIEW_SCALE):
+    # Cheap first guess for streaming: the quarter of the screen around the
+    # cursor at reduced resolution, without per-window segmentation
+    orig_h, orig_w = image.shape[:2]
+    x1, y1, x2, y2 = 0, 0, orig_w, orig_h
+    if cursor is not None:
+        x1 = min(max(0, cursor[0] - orig_w // 4), orig_w - orig_w // 2)
+        y1 = min(max(0, cursor[1] - orig_h // 4), orig_h - orig_h // 2)
+        x2, y2 = x1 + orig_w // 2, y1 + orig_h // 2
+    small = cv2.resize(image[y1:y2, x1:x2], None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    rects = (detect_rects(small, engine, quality, k, min_size, sigma, resize_factor, jobs) / scale).astype(np.int64)
+    rects[:, :2] += (x1, y1)
+    if windows is not None:
+        windows = window_boxes(windows, orig_w, orig_h)
+    return filter_rects(rects, orig_w, orig_h, min_width, min_height, max_width, max_height, nms, windows)
+
+def cursor_order(boxes, cursor):
+    # Nearest to the cursor first; regions under it have distance 0
+    dx = np.maximum(0, np.maximum(boxes[:, 0] - cursor[0], cursor[0] - boxes[:, 0] - boxes[:, 2]))
+    dy = np.maximum(0, np.maximum(boxes[:, 1] - cursor[1], cursor[1] - boxes[:, 1] - boxes[:, 3]))
+    return np.argsort(dx * dx + dy * dy, kind='stable')
+
+def assign_ids(boxes, previous, next_id):
+    # Give each box the ID of the previous batch's box it refines, if any.
+    # previous: list of (id, box). Returns the new list and the next free ID.
+    result = []
+    unused = list(previous)
+    for box in boxes:
+        match = None
+        if unused:
+            overlaps = box_iou(box, np.array([b for _, b in unused]))
+            best = int(np.argmax(overlaps))
+            if overlaps[best] >= STREAM_MATCH_IOU:
+                match = unused.pop(best)[0]
+        if match is None:
+            match, next_id = next_id, next_id + 1
+        result.append((match, box))
+    return result, next_id
+
+def calibration_file():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cache_home, 'quickshell', 'find_regions', 'calibration.json')
+
+def load_calibration():
+    # Measured cost of a selective search pass per strategy, as
+    # {"fast": {"samples": [[pixels, ms], ...], "fixed_ms": a, "ms_per_pixel": b}, "quality": ...}
+    # so that a pass over p processed pixels takes about a + b * p ms
+    try:
+        with open(calibration_file()) as f:
+            calibration = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(calibration, dict):
+        return {}
+    return {strategy: model for strategy, model in calibration.items() if isinstance(model, dict) and 'ms_per_pixel' in model}
+
+def save_calibration(calibration):
+    path = calibration_file()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(calibration, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+def predict_ms(model, pixels):
+    return model['fixed_ms'] + model['ms_per_pixel'] * pixels
+
+def fit_cost(samples, fixed_ms):
+    # Least squares fit of ms = a + b * pixels, where a is the setup that
+    # doesn't scale with the resize factor (resizing the full image,
+    # filtering, NMS). Without enough spread in pixel counts only b is
+    # fitted, keeping the previous a.
+    pixels = np.array([p for p, _ in samples], dtype=np.float64)
+    ms = np.array([t for _, t in samples], dtype=np.float64)
+    if len(samples) >= 2 and pixels.max() >= 1.5 * pixels.min():
+        slope, intercept = np.polyfit(pixels, ms, 1)
+        if slope > 0:
+            return max(0.0, float(intercept)), float(slope)
+    return fixed_ms, max(1e-9, float(np.mean(np.maximum(ms - fixed_ms, 0.0) / pixels)))
+
+def record_timing(calibration, strategy, pixels, elapsed_ms):
+    model = calibration.get(strategy)
+    if model is not None:
+        # A single outlier (a busy CPU) moves the prediction at most this much
+        expected = predict_ms(model, pixels)
+        elapsed_ms = min(max(elapsed_ms, expected / CALIBRATION_STEP_LIMIT), expected * CALIBRATION_STEP_LIMIT)
+    samples = ([] if model is None else model['samples']) + [[pixels, elapsed_ms]]
+    samples = samples[-CALIBRATION_SAMPLES:]
+    fixed_ms, ms_per_pixel = fit_cost(samples, 0.0 if model is None else model['fixed_ms'])
+    calibration[strategy] = {'samples': samples, 'fixed_ms': fixed_ms, 'ms_per_pixel': ms_per_pixel}
+
+def quality_model(calibration):
+    # Before quality mode has run, assume it's QUALITY_SLOWDOWN times slower per pixel
+    if 'quality' in calibration:
+        return calibration['quality']
+    fast = calibration['fast']
+    return {'fixed_ms': fast['fixed_ms'], 'ms_per_pixel': fast['ms_per_pixel'] * QUALITY_SLOWDOWN}
+
+def calibration_probe(image, calibration, options):
+    # First run: a single pass at the smallest budget resize factor. With one
+    # sample its whole time counts as per-pixel cost, which overestimates
+    # bigger passes, so the plan errs on the fast side; later runs record
+    # other sizes and fit the fixed cost. Returns (resize_factor, boxes), as
+    # the probe is a valid result when nothing bigger fits.
+    probe = BUDGET_RESIZE_RANGE[0]
+    start = time.perf_counter()
+    boxes = detect_regions(image, **{**options, 'quality': False, 'resize_factor': probe})
+    pixels = image.shape[0] * image.shape[1] * probe * probe
+    record_timing(calibration, 'fast', pixels, (time.perf_counter() - start) * 1000)
+    return probe, boxes
+
+def plan_budget(image, budget_ms, calibration):
+    # Pick the resize factor and strategy for selective search that should
+    # finish within budget_ms. Quality mode is used when it fits at the
+    # default resolution or better. Returns (resize_factor, quality).
+    pixels = image.shape[0] * image.shape[1]
+    low, high = BUDGET_RESIZE_RANGE
+    fit = lambda model: math.sqrt(max(0.0, budget_ms - model['fixed_ms']) / model['ms_per_pixel'] / pixels)
+    quality = fit(quality_model(calibration))
+    if quality >= DEFAULT_RESIZE_FACTOR:
+        return min(high, quality), True
+    return min(high, max(low, fit(calibration['fast']))), False
+
+def detect_with_budget(image, budget_ms, options):
+    # detect_regions with parameters picked for the time budget. If the
+    # budget allows, a quality pass is added to a fast one. Returns the boxes
+    # and a report of what was applied.
+    start = time.perf_counter()
+    options = dict(options)
+    report = {'budget_ms': budget_ms}
+    if options['engine'] == 'contours':
+        # Always full resolution, nothing to pick
+        boxes = detect_regions(image, **options)
+        report['time_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        return boxes, report
+    calibration = load_calibration()
+    probe = calibration_probe(image, calibration, options) if 'fast' not in calibration else None
+    # The probe is paid for out of the budget
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    resize_factor, quality = plan_budget(image, budget_ms - elapsed_ms, calibration)
+    boxes = None
+    if probe is not None and not quality and resize_factor <= probe[0]:
+        # Nothing bigger than the probe fits in what's left
+        resize_factor, boxes = probe
+    options.update(resize_factor=resize_factor, quality=quality)
+    pixels = image.shape[0] * image.shape[1] * resize_factor * resize_factor
+    if boxes is None:
+        pass_start = time.perf_counter()
+        boxes = detect_regions(image, **options)
+        record_timing(calibration, 'quality' if quality else 'fast', pixels, (time.perf_counter() - pass_start) * 1000)
+    extra_pass = False
+    remaining_ms = budget_ms - (time.perf_counter() - start) * 1000
+    if not quality and predict_ms(quality_model(calibration), pixels) <= remaining_ms:
+        extra_pass = True
+        pass_start = time.perf_counter()
+        extra = detect_regions(image, **{**options, 'quality': True})
+        record_timing(calibration, 'quality', pixels, (time.perf_counter() - pass_start) * 1000)
+        boxes = non_max_suppression(np.concatenate([boxes, extra]), iou_threshold=0.7, method=options['nms'])
+    save_calibration(calibration)
+    report.update({
+        'resize_factor': round(resize_factor, 4),
+        'quality': quality,
+        'extra_quality_pass': extra_pass,
+        'time_ms': round((time.perf_counter() - start) * 1000, 1),
+    })
+    return boxes, report
+
+def window_aware_rects(image, windows, detect, min_width, min_height):
+    # Window borders are hard segment boundaries: each window is segmented on
+    # its own, then whatever no window covers, with the windows blanked out.
+    # Regions that are just a window are left to filter_rects.
+    parts = []
+    for x, y, w, h in windows.tolist():
+        # A window can't contain a region bigger than itself
+        if w <= min_width or h <= min_height:
+            continue
+        rects = detect(image[y:y + h, x:x + w])
+        whole = (rects[:, 0] == 0) & (rects[:, 1] == 0) & (rects[:, 2] == w) & (rects[:, 3] == h)
+        rects = rects[~whole]
+        rects[:, :2] += (x, y)
+        parts.append(rects)
+    for x, y, w, h in uncovered_areas(image.shape[:2], windows, min_width, min_height):
+        rest = image[y:y + h, x:x + w].copy()
+        for wx, wy, ww, wh in windows.tolist():
+            rest[max(0, wy - y):max(0, wy + wh - y), max(0, wx - x):max(0, wx + ww - x)] = 0
+        rects = detect(rest)
+        rects[:, :2] += (x, y)
+        parts.append(rects)
+    return np.concatenate(parts) if parts else np.zeros((0, 4), dtype=np.int64)
+
+def uncovered_areas(shape, windows, min_width, min_height, step=4):
+    # Bounding boxes of the parts of the screen outside all windows that can
+    # hold a min_width x min_height region. Gaps between tiled windows and
+    # bars are too thin and get skipped. Worked out on a coarse grid of
+    # step x step cells, where partly covered cells count as covered.
+    height, width = shape
+    free = np.ones((-(-height // step), -(-width // step)), dtype=np.uint8)
+    for x, y, w, h in windows.tolist():
+        free[y // step:-(-(y + h) // step), x // step:-(-(x + w) // step)] = 0
+    # Opening keeps exactly the cells covered by some fully free rectangle
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (min_width // step // 2 * 2 + 1, min_height // step // 2 * 2 + 1))
+    free = cv2.morphologyEx(free, cv2.MORPH_OPEN, kernel, borderType=cv2.BORDER_CONSTANT, borderValue=0)
+    count, _, stats, _ = cv2.connectedComponentsWithStats(free, connectivity=4)
+    areas = []
+    for x, y, w, h, _ in stats[1:count].tolist():
+        x1, y1 = x * step, y * step
+        areas.append((x1, y1, min(width, (x + w) * step) - x1, min(height, (y + h) * step) - y1))
+    return areas
 
 def draw_regions(image, regions, output_path):
     for region in regions:
@@ -78,24 +556,46 @@ def draw_regions(image, regions, output_path):
     cv2.imwrite(output_path, image)
 
 def main():
-    parser = argparse.ArgumentParser(description='Find regions of interest in an image using selective search.')
-    parser.add_argument('-i', '--image', default=DEFAULT_IMAGE_PATH, help='Path to input image')
+    parser = argparse.ArgumentParser(description='Find regions of interest in an image using selective search or contours.')
+    parser.add_argument('-i', '--image', default=DEFAULT_IMAGE_PATH, help='Path to input image, - for stdin. Uncompressed PGM/PPM/PAM from a pipe or fd (e.g. grim -t ppm) is used without decoding')
+    parser.add_argument('--raw-format', choices=list(RAW_FORMATS), help='Input is an unformatted pixel buffer in this byte order (e.g. bgrx for XRGB8888); needs --raw-width and --raw-height')
+    parser.add_argument('--raw-width', type=int, help='Raw input width in pixels')
+    parser.add_argument('--raw-height', type=int, help='Raw input height in pixels')
+    parser.add_argument('--raw-stride', type=int, help='Raw input bytes per row (default: width times bytes per pixel)')
     parser.add_argument('-do', '--debug-output', help='Path to save debug image with rectangles')
     parser.add_argument('--min-width', type=int, default=200, help='Minimum width of detected region')
     parser.add_argument('--min-height', type=int, default=100, help='Minimum height of detected region')
     parser.add_argument('--max-width', type=int, help='Maximum width of detected region')
     parser.add_argument('--max-height', type=int, help='Maximum height of detected region')
     parser.add_argument('--single', action='store_true', help='Only output the most likely (largest) region')
+    parser.add_argument('--engine', choices=['selective-search', 'contours'], default='selective-search', help='Region detector: selective-search (default, general object proposals) or contours (edges and bounding boxes at full resolution, fast and suited to UI screenshots)')
     parser.add_argument('--quality', action='store_true', help='Use quality mode for selective search (slower, less sensitive)')
     parser.add_argument('--k', type=int, default=3000, help='Segmentation parameter k (default: 150)')
     parser.add_argument('--min-size', type=int, default=50, help='Segmentation parameter min_size (default: 20)')
     parser.add_argument('--sigma', type=float, default=0.6, help='Segmentation parameter sigma (default: 0.8)')
-    parser.add_argument('--resize-factor', type=float, default=0.1, help='Resize factor for input image before processing (default: 1.0, e.g. 0.5 for half size)')
+    parser.add_argument('--resize-factor', type=float, default=DEFAULT_RESIZE_FACTOR, help='Resize factor for input image before processing (default: %(default)s, e.g. 0.5 for half size). Selective search only')
+    parser.add_argument('--jobs', type=int, default=1, help='Selective search only: split the image into this many overlapping tiles searched in parallel, 0 for one per CPU core (default: 1, no tiling)')
+    parser.add_argument('--nms', choices=['numpy', 'opencv'], default='numpy', help='Non-max suppression backend: numpy (default, exact) or opencv (cv2.dnn.NMSBoxes)')
+    parser.add_argument('--windows', metavar='PATH', help='JSON list of window rectangles (hyprctl clients format, or x/y/width/height), "-" for stdin. Windows are segmented separately and regions that are just a window are dropped')
+    parser.add_argument('--stream', action='store_true', help='Output JSON Lines, one {"batch", "final", "regions"} object per pass: a quick low resolution preview first, then the full result. Regions carry IDs that stay the same when refined')
+    parser.add_argument('--cursor', metavar='X,Y', help='Streaming: cursor position. The preview covers the area around it and regions are sorted by distance to it')
+    parser.add_argument('--time-budget-ms', type=float, help='Pick --resize-factor and --quality to finish selective search within this many ms, from throughput measured on earlier runs. Output becomes {"regions": [...]} plus the applied parameters and time taken')
     parser.add_argument('--hyprctl', action='store_true', help='Mimics hyprctl\'s window output, like {"at": [x, y], "size": [w, h]}')
     args = parser.parse_args()
+    if args.raw_format and not (args.raw_width and args.raw_height):
+        parser.error('--raw-format needs --raw-width and --raw-height')
+    if args.image == '-' and args.windows == '-':
+        parser.error('only one of --image and --windows can read stdin')
+
+    windows = None
+    if args.windows:
+        if args.windows == '-':
+            windows = json.load(sys.stdin)
+        else:
+            with open(args.windows) as f:
+                windows = json.load(f)
 
-    regions, image = find_regions(
-        args.image,
+    options = dict(
         min_width=args.min_width,
         min_height=args.min_height,
         max_width=args.max_width,
@@ -104,16 +604,67 @@ def main():
         k=args.k,
         min_size=args.min_size,
         sigma=args.sigma,
-        resize_factor=args.resize_factor
+        resize_factor=args.resize_factor,
+        nms=args.nms,
+        engine=args.engine,
+        windows=windows,
+        jobs=args.jobs or os.cpu_count() or 1
     )
+    # Read once; the colour image for drawing is only made for debug output
+    pixels, order = read_pixels(args.image, args.raw_format, args.raw_width, args.raw_height, args.raw_stride, gray=args.engine == 'contours')
+    image = convert_pixels(pixels, order, 'gray' if args.engine == 'contours' else 'bgr')
+    if args.stream:
+        regions = stream_regions(args, image, options)
+    else:
+        if args.time_budget_ms is not None:
+            boxes, report = detect_with_budget(image, args.time_budget_ms, options)
+        else:
+            boxes, report = detect_regions(image, **options), None
+        regions = [{'x': x, 'y': y, 'width': w, 'height': h} for x, y, w, h in boxes.tolist()]
+        output = format_regions(regions, args)
+        print(json.dumps(output if report is None else {'regions': output, **report}))
+    if args.debug_output:
+        # draw_regions draws in place, so never on the input buffer itself
+        if order == 'gray' and not args.raw_format and os.path.isfile(args.image):
+            image = cv2.imread(args.image)
+        else:
+            image = convert_pixels(pixels, order, 'bgr')
+        draw_regions(image.copy() if image is pixels else image, format_regions(regions, args), args.debug_output)
+
+def format_regions(regions, args):
     if args.single and regions:
         largest = max(regions, key=lambda r: r['width'] * r['height'])
         regions = [largest]
     if args.hyprctl:
-        regions = [{"at": [r['x'], r['y']], "size": [r['width'], r['height']]} for r in regions]
-    print(json.dumps(regions))
-    if args.debug_output:
-        draw_regions(image, regions, args.debug_output)
+        regions = [{**({'id': r['id']} if 'id' in r else {}), "at": [r['x'], r['y']], "size": [r['width'], r['height']]} for r in regions]
+    return regions
+
+def stream_regions(args, image, options):
+    # One JSON line per batch: a quick preview, then the full result. Each
+    # batch is the complete current set of regions; a region keeps its ID when
+    # a later batch refines it. With a time budget, the final batch also
+    # carries the budget report. Returns the final regions.
+    cursor = tuple(int(v) for v in args.cursor.split(',')) if args.cursor else None
+    if args.time_budget_ms is not None:
+        final_pass = lambda: detect_with_budget(image, args.time_budget_ms, options)
+    else:
+        final_pass = lambda: (detect_regions(image, **options), {})
+    passes = [
+        lambda: (preview_regions(image, cursor=cursor, **options), {}),
+        final_pass,
+    ]
+    previous, next_id = [], 0
+    for i, run in enumerate(passes):
+        boxes, report = run()
+        if cursor is not None:
+            boxes = boxes[cursor_order(boxes, cursor)]
+        previous, next_id = assign_ids(boxes, previous, next_id)
+        regions = []
+        for region_id, box in previous:
+            x, y, w, h = box.tolist()
+            regions.append({'id': region_id, 'x': x, 'y': y, 'width': w, 'height': h})
+        print(json.dumps({'batch': i, 'final': i == len(passes) - 1, 'regions': format_regions(regions, args), **report}), flush=True)
+    return regions
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# Offline speed and accuracy benchmark for find_regions.py. Screenshots are
+# generated procedurally (a wallpaper, a bar, tiled windows with title bars,
+# text, buttons, cards and pictures), so the content regions are known
+# exactly. Every configuration runs over the same corpus in a fresh process
+# and the report is printed as JSON.
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import find_regions
+
+# Name and detect_regions options of every configuration compared by default
+DEFAULT_CONFIGS = [
+    ('contours', {'engine': 'contours'}),
+    ('selective-search', {'engine': 'selective-search', 'k': 3000, 'min_size': 50, 'sigma': 0.6, 'resize_factor': 0.1}),
+    ('selective-search-help-defaults', {'engine': 'selective-search', 'k': 150, 'min_size': 20, 'sigma': 0.8, 'resize_factor': 0.1}),
+    ('selective-search-0.2', {'engine': 'selective-search', 'k': 3000, 'min_size': 50, 'sigma': 0.6, 'resize_factor': 0.2}),
+    ('selective-search-0.2-tiled', {'engine': 'selective-search', 'k': 3000, 'min_size': 50, 'sigma': 0.6, 'resize_factor': 0.2, 'jobs': 4}),
+]
+DEFAULT_IOU_THRESHOLDS = [0.5, 0.75]
+BAR_HEIGHT = 40
+TITLE_HEIGHT = 32
+GAP = 10
+
+def random_color(rng, low=0, high=256):
+    return tuple(int(c) for c in rng.integers(low, high, 3))
+
+def draw_text_lines(image, rng, x1, y1, x2, y2, color):
+    for y in range(y1 + 24, y2 - 8, int(rng.integers(22, 36))):
+        words = ' '.join('lorem ipsum dolor sit amet consectetur'.split()[:int(rng.integers(2, 7))])
+        cv2.putText(image, words, (x1 + 8, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1, cv2.LINE_AA)
+
+def split_screen(x, y, w, h, count):
+    # Tile like a dwindle layout: halve the remaining area along its long side
+    tiles = []
+    for _ in range(count - 1):
+        if w >= h:
+            half = w // 2
+            tiles.append((x, y, half - GAP // 2, h))
+            x, w = x + half + GAP // 2, w - half - GAP // 2
+        else:
+            half = h // 2
+            tiles.append((x, y, w, half - GAP // 2))
+            y, h = y + half + GAP // 2, h - half - GAP // 2
+    tiles.append((x, y, w, h))
+    return tiles
+
+def generate_screenshot(rng, width, height):
+    # Returns the BGR screenshot, the window rectangles and the ground truth
+    # content regions, all as x, y, w, h tuples
+    small = rng.integers(0, 256, (4, 6, 3)).astype(np.uint8)
+    image = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    image = cv2.add(image, rng.integers(0, 12, image.shape, dtype=np.uint8))
+    cv2.rectangle(image, (0, 0), (width, BAR_HEIGHT), (24, 24, 28), -1)
+    draw_text_lines(image, rng, width // 2 - 60, 0, width // 2 + 60, BAR_HEIGHT, (220, 220, 220))
+    windows, truth = [], []
+    dark = rng.random() < 0.5
+    for x, y, w, h in split_screen(GAP, BAR_HEIGHT + GAP, width - 2 * GAP, height - BAR_HEIGHT - 2 * GAP, int(rng.integers(1, 5))):
+        windows.append((x, y, w, h))
+        background = (32, 30, 36) if dark else (242, 240, 238)
+        foreground = (210, 210, 210) if dark else (40, 40, 40)
+        cv2.rectangle(image, (x, y), (x + w - 1, y + h - 1), background, -1)
+        cv2.rectangle(image, (x, y), (x + w - 1, y + TITLE_HEIGHT), tuple(c - 12 if dark else c - 30 for c in background), -1)
+        draw_text_lines(image, rng, x, y, x + w // 3, y + TITLE_HEIGHT, foreground)
+        # Cards, pictures and panels on a text background
+        draw_text_lines(image, rng, x, y + TITLE_HEIGHT, x + w, y + h, foreground)
+        occupied = []
+        for _ in range(int(rng.integers(2, 8))):
+            cw, ch = int(rng.integers(120, max(121, w // 2))), int(rng.integers(60, max(61, h // 2)))
+            if cw >= w - 2 * GAP or ch >= h - TITLE_HEIGHT - 2 * GAP:
+                continue
+            cx = x + GAP + int(rng.integers(0, w - cw - 2 * GAP))
+            cy = y + TITLE_HEIGHT + GAP + int(rng.integers(0, h - ch - TITLE_HEIGHT - 2 * GAP))
+            if any(cx < ox + ow + GAP and ox < cx + cw + GAP and cy < oy + oh + GAP and oy < cy + ch + GAP for ox, oy, ow, oh in occupied):
+                continue
+            occupied.append((cx, cy, cw, ch))
+            kind = rng.integers(0, 3)
+            if kind == 0:
+                # Picture
+                picture = cv2.resize(rng.integers(0, 256, (6, 8, 3)).astype(np.uint8), (cw, ch), interpolation=cv2.INTER_CUBIC)
+                image[cy:cy + ch, cx:cx + cw] = cv2.add(picture, rng.integers(0, 40, picture.shape, dtype=np.uint8))
+            else:
+                # Card or button with text, bordered or just filled
+                cv2.rectangle(image, (cx, cy), (cx + cw - 1, cy + ch - 1), random_color(rng, 40, 230), -1)
+                if kind == 1:
+                    cv2.rectangle(image, (cx, cy), (cx + cw - 1, cy + ch - 1), foreground, 2)
+                draw_text_lines(image, rng, cx, cy, cx + cw, cy + ch, (255, 255, 255))
+            truth.append((cx, cy, cw, ch))
+    return image, windows, truth
+
+def generate_corpus(count, width, height, seed):
+    rng = np.random.default_rng(seed)
+    return [generate_screenshot(rng, width, height) for _ in range(count)]
+
+def match_count(detections, truth, threshold):
+    # One-to-one matches at IoU >= threshold, best pairs first
+    if len(detections) == 0 or len(truth) == 0:
+        return 0
+    detections, truth = np.asarray(detections, dtype=np.int64), np.asarray(truth, dtype=np.int64)
+    overlaps = np.stack([find_regions.box_iou(t, detections) for t in truth])
+    matched, used_truth, used_detections = 0, set(), set()
+    for flat in np.argsort(-overlaps, axis=None, kind='stable').tolist():
+        t, d = divmod(flat, overlaps.shape[1])
+        if overlaps[t, d] < threshold:
+            break
+        if t in used_truth or d in used_detections:
+            continue
+        used_truth.add(t)
+        used_detections.add(d)
+        matched += 1
+    return matched
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 2) if values else None
+
+def run_config(connection, corpus_args, options, filters, use_windows, thresholds, repeat):
+    # Runs in its own process, so the peak RSS belongs to this configuration
+    corpus = generate_corpus(*corpus_args)
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    latencies, detections, truths = [], [], []
+    for image, windows, truth in corpus:
+        if options.get('engine') == 'contours':
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        kwargs = {**filters, **options, 'windows': [{'x': x, 'y': y, 'width': w, 'height': h} for x, y, w, h in windows] if use_windows else None}
+        boxes = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            boxes = find_regions.detect_regions(image, **kwargs)
+            latencies.append((time.perf_counter() - start) * 1000)
+        detections.append(boxes.tolist())
+        # Ground truth gets the same size limits as the detections
+        truths.append([t for t in truth if filters['min_width'] < t[2] < filters['max_width'] and filters['min_height'] < t[3] < filters['max_height']])
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    accuracy = {}
+    total_detections = sum(len(d) for d in detections)
+    total_truth = sum(len(t) for t in truths)
+    for threshold in thresholds:
+        matched = sum(match_count(d, t, threshold) for d, t in zip(detections, truths))
+        accuracy[str(threshold)] = {
+            'precision': round(matched / total_detections, 4) if total_detections else None,
+            'recall': round(matched / total_truth, 4) if total_truth else None,
+        }
+    connection.send({
+        'latency_ms': {'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95), 'mean': round(float(np.mean(latencies)), 2)},
+        'peak_rss_mb': round(peak_kb / 1024, 1),
+        'peak_rss_delta_mb': round((peak_kb - baseline_kb) / 1024, 1),
+        'detections': total_detections,
+        'ground_truth': total_truth,
+        'accuracy': accuracy,
+    })
+    connection.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark find_regions.py engines and parameters on generated screenshots with known regions.')
+    parser.add_argument('--count', type=int, default=20, help='Number of screenshots in the corpus (default: 20)')
+    parser.add_argument('--size', default='1920x1080', help='Screenshot size (default: 1920x1080)')
+    parser.add_argument('--seed', type=int, default=0, help='Corpus seed (default: 0)')
+    parser.add_argument('--repeat', type=int, default=1, help='Timed runs per screenshot (default: 1)')
+    parser.add_argument('--config', action='append', default=[], metavar='JSON', help='Benchmark this {"name": ..., "engine": ..., other detect_regions options} instead of the defaults (can be repeated)')
+    parser.add_argument('--iou', type=float, action='append', help=f'IoU threshold for precision/recall (can be repeated, default: {DEFAULT_IOU_THRESHOLDS})')
+    parser.add_argument('--min-width', type=int, default=200, help='Minimum region width, as in find_regions.py')
+    parser.add_argument('--min-height', type=int, default=100, help='Minimum region height, as in find_regions.py')
+    parser.add_argument('--no-windows', action='store_true', help="Don't pass the window rectangles to the detector")
+    parser.add_argument('--save-corpus', metavar='DIR', help='Also write the screenshots and their ground truth to DIR')
+    parser.add_argument('--output', help='Write the report to this file instead of stdout')
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    # Like the region selector: regions at most half the screen
+    filters = {'min_width': args.min_width, 'min_height': args.min_height, 'max_width': width // 2, 'max_height': height // 2}
+    thresholds = args.iou or DEFAULT_IOU_THRESHOLDS
+    configs = DEFAULT_CONFIGS
+    if args.config:
+        configs = []
+        for config in args.config:
+            options = json.loads(config)
+            configs.append((options.pop('name', config), options))
+
+    if args.save_corpus:
+        os.makedirs(args.save_corpus, exist_ok=True)
+        for i, (image, windows, truth) in enumerate(generate_corpus(args.count, width, height, args.seed)):
+            cv2.imwrite(os.path.join(args.save_corpus, f'{i:03d}.png'), image)
+            with open(os.path.join(args.save_corpus, f'{i:03d}.json'), 'w') as f:
+                json.dump({'windows': windows, 'regions': truth}, f)
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for name, options in configs:
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=run_config, args=(sender, (args.count, width, height, args.seed), options, filters, not args.no_windows, thresholds, args.repeat))
+        process.start()
+        sender.close()
+        result = receiver.recv()
+        process.join()
+        results.append({'name': name, 'options': options, **result})
+        print(f'{name}: p50 {result["latency_ms"]["p50"]} ms', file=sys.stderr)
+
+    report = {
+        'corpus': {'count': args.count, 'width': width, 'height': height, 'seed': args.seed, 'windows': not args.no_windows},
+        'filters': filters,
+        'cpu_count': os.cpu_count(),
+        'opencv': cv2.__version__,
+        'configs': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
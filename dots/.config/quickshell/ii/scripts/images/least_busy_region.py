@@ -3,10 +3,49 @@
 
 import os
 os.environ["OPENCV_LOG_LEVEL"] = "SILENT"
-import cv2
-import numpy as np
 import argparse
+import hashlib
 import json
+import sys
+from busyness_map import DEFAULT_BLOCK as DEFAULT_MAP_BLOCK, write_busyness_map
+
+# OpenCV and NumPy are most of the startup time, so they're only imported
+# once a result has to be computed (see import_compute_modules)
+cv2 = None
+np = None
+
+DEFAULT_CACHE_SIZE = 64
+# Part of every cache key; bump when the same arguments give different results
+CACHE_VERSION = 2
+# Same list as AbstractBackgroundWidget.qml
+VIDEO_EXTENSIONS = (".mp4", ".webm", ".mkv", ".avi", ".mov")
+DEFAULT_VIDEO_FRAMES = 16
+# Seek instead of decoding through gaps longer than this many frames
+VIDEO_SEEK_THRESHOLD = 30
+# Window rows per strip in low memory mode
+LOW_MEMORY_STRIP_ROWS = 64
+# Size of the probe that bounds the largest region sizes above it, relative
+# to the size being tested (see find_largest_region)
+LARGEST_REGION_PROBE_RATIO = 0.8
+# Largest offset between the windows that windows_under_threshold bounds
+# together, relative to the shorter window side
+LARGEST_REGION_CELL_SPAN = 1 / 16
+# Cost of looking up one window through gathered integral image reads,
+# relative to the slice-based scan of every position (see coarse_to_fine_search)
+COARSE_TO_FINE_LOOKUP_COST = 6
+# Per-pixel busyness maps, see PreparedWallpaper._compute_metric_integrals
+BUSYNESS_METRICS = ["variance", "gradient", "edges", "lab"]
+# Upper bound on the pixels looked at for the dominant color of a region
+DOMINANT_COLOR_SAMPLES = 4096
+# Arguments that don't affect the result
+CACHE_IGNORED_ARGS = {"image_path", "verbose", "visual_output", "no_cache", "cache_size", "batch", "query", "export_map", "map_block"}
+# Arguments that apply to a whole batch and can't be set per query
+QUERY_FIXED_ARGS = {"image_path", "verbose", "no_cache", "cache_size", "batch", "query", "export_map", "map_block"}
+
+def import_compute_modules():
+    global cv2, np
+    import cv2
+    import numpy as np
 
 def center_crop(img, target_w, target_h):
     h, w = img.shape[:2]
@@ -18,11 +57,9 @@ def center_crop(img, target_w, target_h):
     y2 = y1 + target_h
     return img[y1:y2, x1:x2]
 
-def find_least_busy_region(image_path, region_width=300, region_height=200, screen_width=None, screen_height=None, verbose=False, stride=2, screen_mode="fill", horizontal_padding=50, vertical_padding=50, busiest=False):
-    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-    if img is None:
-        raise FileNotFoundError(f"Image not found: {image_path}")
-    orig_h, orig_w = img.shape
+def fit_to_screen(img, screen_width=None, screen_height=None, screen_mode="fill", verbose=False):
+    # Scale and center crop like the wallpaper is shown. Returns (img, scale).
+    orig_h, orig_w = img.shape[:2]
     scale = 1.0
     if screen_width is not None and screen_height is not None:
         scale_w = screen_width / orig_w
@@ -42,10 +79,260 @@ def find_least_busy_region(image_path, region_width=300, region_height=200, scre
     else:
         if verbose:
             print(f"Using original image size: {orig_w}x{orig_h}")
-    arr = img.astype(np.float64)
-    h, w = arr.shape
-    # Validate & adjust stride
-    stride = max(1, int(stride) if stride else 1)
+    return img, scale
+
+def is_video(path):
+    return path.lower().endswith(VIDEO_EXTENSIONS)
+
+def read_video_statistics(video_path, screen_width=None, screen_height=None, screen_mode="fill", frames=DEFAULT_VIDEO_FRAMES, verbose=False):
+    # Stream up to `frames` evenly spaced frames and fold each one into running
+    # per-pixel statistics (Welford), so memory doesn't depend on the video
+    # length. Returns the mean frame (BGR, uint8) and the per-pixel temporal
+    # variance of the grayscale values.
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise FileNotFoundError(f"Video not found or unsupported: {video_path}")
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if total > 0:
+        wanted = sorted(set(np.linspace(0, total - 1, max(1, min(frames, total))).round().astype(int).tolist()))
+    else:
+        wanted = list(range(max(1, frames)))
+    n = 0
+    position = 0
+    mean_bgr = mean_gray = m2 = None
+    for index in wanted:
+        if index - position > VIDEO_SEEK_THRESHOLD:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            position = index
+        while position < index and cap.grab():
+            position += 1
+        ok, frame = cap.read()
+        if not ok:
+            break
+        position += 1
+        frame, _ = fit_to_screen(frame, screen_width, screen_height, screen_mode, verbose and n == 0)
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY).astype(np.float32)
+        n += 1
+        if mean_gray is None:
+            mean_bgr = frame.astype(np.float32)
+            mean_gray = gray
+            m2 = np.zeros_like(gray)
+            continue
+        delta = gray - mean_gray
+        mean_gray += delta / n
+        m2 += delta * (gray - mean_gray)
+        cv2.accumulateWeighted(frame, mean_bgr, 1.0 / n)
+    cap.release()
+    if n == 0:
+        raise FileNotFoundError(f"Could not decode any frame of {video_path}")
+    if verbose:
+        print(f"Sampled {n} of {total if total > 0 else '?'} frames")
+    return np.clip(np.rint(mean_bgr), 0, 255).astype(np.uint8), m2 / n
+
+class PreparedWallpaper:
+    # Wallpaper decoded, scaled and cropped to the screen once. The region
+    # search reads the grayscale view, the dominant color and visual output
+    # the color one. Videos are represented by their mean frame plus the
+    # temporal variance.
+    def __init__(self, image_path, screen_width=None, screen_height=None, screen_mode="fill", verbose=False, decoded=None, video_frames=DEFAULT_VIDEO_FRAMES):
+        # decoded: dict of full-size decodes by imread flags, shared to
+        # prepare several screen geometries from one read of each
+        self.image_path = image_path
+        self.screen = (screen_width, screen_height, screen_mode)
+        self._decoded = decoded
+        self.temporal_variance = None
+        if is_video(image_path):
+            img, self.temporal_variance = read_video_statistics(image_path, screen_width, screen_height, screen_mode, video_frames, verbose)
+            scale = None
+        else:
+            img, scale = fit_to_screen(self._read(cv2.IMREAD_COLOR), screen_width, screen_height, screen_mode, verbose)
+        self.scale = scale
+        self.bgr = img
+        self._gray = None
+        self._integrals = None
+        self._metric_integrals = {}
+        self._exclusion_integrals = {}
+
+    def _read(self, flags):
+        if self._decoded is not None and flags in self._decoded:
+            return self._decoded[flags]
+        img = cv2.imread(self.image_path, flags)
+        if img is None:
+            raise FileNotFoundError(f"Image not found: {self.image_path}")
+        if self._decoded is not None:
+            self._decoded[flags] = img
+        return img
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            if self.temporal_variance is not None:
+                self._gray = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY)
+            else:
+                # Decoded as grayscale and then scaled, not converted from the
+                # scaled color image: that rounds differently, and on flat
+                # wallpapers the tiny differences move the placement
+                self._gray, _ = fit_to_screen(self._read(cv2.IMREAD_GRAYSCALE), *self.screen)
+        return self._gray
+
+    def integrals(self):
+        # Integral images of the grayscale values and their squares, shared by
+        # every query against this wallpaper
+        if self._integrals is None:
+            self._integrals = gray_integrals(self.gray)
+        return self._integrals
+
+    def exclusion_integral(self, exclude):
+        # Integral image of the excluded area, see exclusion_mask; None if
+        # nothing is excluded
+        if not exclude:
+            return None
+        key = tuple(exclude)
+        if key not in self._exclusion_integrals:
+            self._exclusion_integrals[key] = cv2.integral(exclusion_mask(self.gray.shape, exclude), sdepth=cv2.CV_32S)
+        return self._exclusion_integrals[key]
+
+    def metric_terms(self, metric="variance"):
+        # Busyness metric as a list of (weight, kind, integrals) terms, see
+        # metric_grid. Each per-pixel map is computed and integrated once.
+        terms = []
+        for name, weight in parse_metric(metric):
+            if name not in self._metric_integrals:
+                self._metric_integrals[name] = self._compute_metric_integrals(name)
+            terms.extend((weight, kind, integrals) for kind, integrals in self._metric_integrals[name])
+        return terms
+
+    def _compute_metric_integrals(self, name):
+        # All metrics are in squared 8-bit intensity units, like the variance
+        if name == "variance":
+            if self.temporal_variance is None:
+                return [("variance", self.integrals())]
+            # Law of total variance: the variance over all pixels of the window
+            # across all sampled frames is the spatial variance of the mean
+            # frame plus the mean of the per-pixel temporal variance
+            return [("variance", self.integrals()), ("mean", (cv2.integral(self.temporal_variance.astype(np.float64), sdepth=cv2.CV_64F),))]
+        if name == "gradient":
+            # Sobel gradient energy; a 3x3 Sobel kernel has a gain of 4
+            gray = self.gray.astype(np.float32)
+            gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+            gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+            energy = (gx.astype(np.float64) ** 2 + gy.astype(np.float64) ** 2) / 16
+            return [("mean", (cv2.integral(energy, sdepth=cv2.CV_64F),))]
+        if name == "edges":
+            # Canny edge density, an edge pixel counting as full contrast
+            edges = (cv2.Canny(self.gray, 100, 200) > 0).astype(np.float64) * (255.0 ** 2)
+            return [("mean", (cv2.integral(edges, sdepth=cv2.CV_64F),))]
+        if name == "lab":
+            # Sum of the variances of the L, a and b channels
+            terms = []
+            for channel in cv2.split(cv2.cvtColor(self.bgr, cv2.COLOR_BGR2Lab)):
+                terms.append(("variance", gray_integrals(channel)))
+            return terms
+        raise ValueError(f"Unknown busyness metric: {name}")
+
+def gray_integrals(gray):
+    # Integral images of an 8-bit image and of its squares, built straight from
+    # the 8-bit data without float or squared copies. Sums are integers, so
+    # int32 is exact whenever the total fits, and float64 is exact up to 2**53.
+    # Either way the window sums equal those of a float64 computation.
+    sdepth = cv2.CV_32S if 255 * gray.size < 2**31 else cv2.CV_64F
+    return cv2.integral2(gray, sdepth=sdepth, sqdepth=cv2.CV_64F)
+
+def parse_rect(rect):
+    # "x,y,w,h", or an [x, y, w, h] list from a batch query
+    values = rect.split(",") if isinstance(rect, str) else rect
+    if len(values) != 4:
+        raise ValueError(f"Expected x,y,w,h, got: {rect}")
+    return tuple(int(round(float(v))) for v in values)
+
+def exclusion_mask(shape, exclude):
+    # 1 where a window must not be placed. Any number of rectangles ends up as
+    # one mask, so checking a window against all of them is a single
+    # integral image lookup.
+    mask = np.zeros(shape, dtype=np.uint8)
+    for x, y, w, h in exclude:
+        mask[max(0, y):max(0, y + h), max(0, x):max(0, x + w)] = 1
+    return mask
+
+def reject_excluded(grid, exclusion_ii, x_start, y_start, nx, ny, region_w, region_h, stride=1, busiest=False, lattices=None):
+    # Set windows that intersect the excluded area to the worst possible score
+    if exclusion_ii is None:
+        return grid
+    blocked = window_sums(exclusion_ii, x_start, y_start, nx, ny, region_w, region_h, stride, lattices) > 0
+    return np.where(blocked, -np.inf if busiest else np.inf, grid)
+
+def parse_metric(metric):
+    # "variance", or a weighted combination such as "variance:1,edges:0.5"
+    parsed = []
+    for part in metric.split(","):
+        name, _, weight = part.strip().partition(":")
+        if name not in BUSYNESS_METRICS:
+            raise ValueError(f"Unknown busyness metric: {name} (choose from {', '.join(BUSYNESS_METRICS)})")
+        weight = float(weight) if weight else 1.0
+        # The coarse-to-fine and largest region bounds need every term to grow
+        # with busyness
+        if not weight >= 0:
+            raise ValueError(f"Busyness metric weights must be 0 or more: {part.strip()}")
+        parsed.append((name, weight))
+    return parsed
+
+def load_wallpaper(image, screen_width=None, screen_height=None, screen_mode="fill", verbose=False, video_frames=DEFAULT_VIDEO_FRAMES):
+    # Accept either a path or an already prepared wallpaper
+    if isinstance(image, PreparedWallpaper):
+        return image
+    return PreparedWallpaper(image, screen_width, screen_height, screen_mode, verbose, video_frames=video_frames)
+
+def lattice_slice(ii, y0, x0, ny, nx, stride, lattices=None):
+    # ii[y0::stride, x0::stride] limited to ny x nx entries. With a lattices
+    # dict, each stride phase of ii is copied once into a contiguous array so
+    # repeated lookups (one per window size) don't stride through memory.
+    if lattices is None or stride == 1:
+        return ii[y0:y0 + (ny - 1) * stride + 1:stride, x0:x0 + (nx - 1) * stride + 1:stride]
+    phase = (y0 % stride, x0 % stride)
+    key = (id(ii), phase)
+    if key not in lattices:
+        lattices[key] = np.ascontiguousarray(ii[phase[0]::stride, phase[1]::stride])
+    ly, lx = y0 // stride, x0 // stride
+    return lattices[key][ly:ly + ny, lx:lx + nx]
+
+def window_sums(ii, x_start, y_start, nx, ny, region_w, region_h, stride=1, lattices=None):
+    # Sums of all region_w x region_h windows whose top-left corners lie on the
+    # stride lattice starting at (x_start, y_start). ii is a full (h+1, w+1)
+    # integral image as returned by cv2.integral.
+    top, bottom = y_start, y_start + region_h
+    left, right = x_start, x_start + region_w
+    return (lattice_slice(ii, bottom, right, ny, nx, stride, lattices)
+            - lattice_slice(ii, bottom, left, ny, nx, stride, lattices)
+            - lattice_slice(ii, top, right, ny, nx, stride, lattices)
+            + lattice_slice(ii, top, left, ny, nx, stride, lattices))
+
+def variance_grid(integral, integral_sq, x_start, y_start, nx, ny, region_w, region_h, stride=1, lattices=None):
+    # Variance of every window on the stride lattice, shape (ny, nx)
+    area = region_w * region_h
+    s = window_sums(integral, x_start, y_start, nx, ny, region_w, region_h, stride, lattices)
+    s2 = window_sums(integral_sq, x_start, y_start, nx, ny, region_w, region_h, stride, lattices)
+    mean = s / area
+    return (s2 / area) - (mean ** 2)
+
+def metric_grid(terms, x_start, y_start, nx, ny, region_w, region_h, stride=1, lattices=None):
+    # Busyness of every window on the stride lattice, shape (ny, nx). A metric
+    # is a weighted sum of terms: "variance" terms take the variance of a map
+    # from its (integral, integral_sq) pair, "mean" terms average a map.
+    total = None
+    for weight, kind, integrals in terms:
+        if kind == "variance":
+            grid = variance_grid(integrals[0], integrals[1], x_start, y_start, nx, ny, region_w, region_h, stride, lattices)
+        else:
+            grid = window_sums(integrals[0], x_start, y_start, nx, ny, region_w, region_h, stride, lattices) / (region_w * region_h)
+        grid = weight * grid
+        total = grid if total is None else total + grid
+    return total
+
+def placement_area(wallpaper, region_width, region_height, horizontal_padding, vertical_padding, verbose=False):
+    # Range of allowed top-left positions for one region size. Returns
+    # (region_width, region_height, x_start, y_start, x_end, y_end), with
+    # x_end < x_start or y_end < y_start if nothing fits.
+    h, w = wallpaper.gray.shape
     # Adjust region size if it does not fit given padding
     if horizontal_padding * 2 >= w or vertical_padding * 2 >= h:
         # Reduce padding to fit at least a 1x1 region
@@ -63,24 +350,6 @@ def find_least_busy_region(image_path, region_width=300, region_height=200, scre
         if verbose:
             print(f"Requested region_height {region_height} too large; clamping to {max_region_h}")
         region_height = max_region_h
-    # Use OpenCV's integral for fast computation
-    integral = cv2.integral(arr, sdepth=cv2.CV_64F)[1:,1:]
-    integral_sq = cv2.integral(arr**2, sdepth=cv2.CV_64F)[1:,1:]
-    def region_sum(ii, x1, y1, x2, y2):
-        # Assume bounds have been checked before calling
-        total = ii[y2, x2]
-        if x1 > 0:
-            total -= ii[y2, x1-1]
-        if y1 > 0:
-            total -= ii[y1-1, x2]
-        if x1 > 0 and y1 > 0:
-            total += ii[y1-1, x1-1]
-        return total
-    min_var = None
-    max_var = None
-    min_coords = (horizontal_padding, vertical_padding)
-    max_coords = (horizontal_padding, vertical_padding)
-    area = region_width * region_height
     x_start = horizontal_padding
     y_start = vertical_padding
     x_end = w - region_width - horizontal_padding + 1
@@ -89,54 +358,283 @@ def find_least_busy_region(image_path, region_width=300, region_height=200, scre
         x_end = x_start
     if y_end < y_start:
         y_end = y_start
-    for y in range(y_start, y_end + 1, stride):
-        for x in range(x_start, x_end + 1, stride):
-            x1, y1 = x, y
-            x2, y2 = x + region_width - 1, y + region_height - 1
-            if x2 >= w or y2 >= h:
-                continue  # Skip out-of-bounds window
-            s = region_sum(integral, x1, y1, x2, y2)
-            s2 = region_sum(integral_sq, x1, y1, x2, y2)
-            mean = s / area
-            var = (s2 / area) - (mean ** 2)
-            if (min_var is None) or (var < min_var):
-                min_var = var
-                min_coords = (x, y)
-            if (max_var is None) or (var > max_var):
-                max_var = var
-                max_coords = (x, y)
-    if busiest:
-        return max_coords, max_var
-    else:
-        return min_coords, min_var
-
-def find_largest_region(image_path, screen_width=None, screen_height=None, verbose=False, stride=2, screen_mode="fill", threshold=100.0, aspect_ratio=1.0, horizontal_padding=50, vertical_padding=50):
-    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-    if img is None:
-        raise FileNotFoundError(f"Image not found: {image_path}")
-    orig_h, orig_w = img.shape
-    # ...existing scaling logic...
-    scale = 1.0
-    if screen_width is not None and screen_height is not None:
-        scale_w = screen_width / orig_w
-        scale_h = screen_height / orig_h
-        if screen_mode == "fill":
-            scale = max(scale_w, scale_h)
+    # Only keep window positions that fit inside the image
+    x_end = min(x_end, w - region_width)
+    y_end = min(y_end, h - region_height)
+    return region_width, region_height, x_start, y_start, x_end, y_end
+
+def placement_grid(wallpaper, region_width, region_height, stride, horizontal_padding, vertical_padding, verbose=False, metric="variance", busiest=False, exclude=None):
+    # Busyness grid of every allowed position for one region size. Returns
+    # (variance, x_start, y_start, stride); variance is None if nothing fits.
+    # Excluded positions score inf (-inf with busiest).
+    # Validate & adjust stride
+    stride = max(1, int(stride) if stride else 1)
+    region_width, region_height, x_start, y_start, x_end, y_end = placement_area(wallpaper, region_width, region_height, horizontal_padding, vertical_padding, verbose)
+    if x_end < x_start or y_end < y_start:
+        return None, x_start, y_start, stride
+    # Use OpenCV's integral for fast computation
+    terms = wallpaper.metric_terms(metric)
+    nx = (x_end - x_start) // stride + 1
+    ny = (y_end - y_start) // stride + 1
+    variance = metric_grid(terms, x_start, y_start, nx, ny, region_width, region_height, stride)
+    variance = reject_excluded(variance, wallpaper.exclusion_integral(exclude), x_start, y_start, nx, ny, region_width, region_height, stride, busiest)
+    return variance, x_start, y_start, stride
+
+def rect_sum(ii, x1, y1, x2, y2):
+    # Sums over the rectangles [x1, x2) x [y1, y2), given as arrays
+    return ii[y2, x2] - ii[y2, x1] - ii[y1, x2] + ii[y1, x1]
+
+def rect_variance(integral, integral_sq, x1, y1, x2, y2):
+    # Variance of the rectangles [x1, x2) x [y1, y2), given as arrays
+    area = (x2 - x1) * (y2 - y1)
+    s = rect_sum(integral, x1, y1, x2, y2)
+    s2 = rect_sum(integral_sq, x1, y1, x2, y2)
+    mean = s / area
+    return (s2 / area) - (mean ** 2)
+
+def rect_metric(terms, x1, y1, x2, y2, area=None):
+    # Busyness of the rectangles [x1, x2) x [y1, y2), given as arrays. With
+    # area, every term is instead scaled to a window of that area containing
+    # (or contained in) the rectangle, which bounds the window's busyness.
+    rect_area = (x2 - x1) * (y2 - y1)
+    total = None
+    for weight, kind, integrals in terms:
+        if kind == "variance":
+            value = rect_variance(integrals[0], integrals[1], x1, y1, x2, y2)
+            if area is not None:
+                value = value * rect_area / area
         else:
-            scale = min(scale_w, scale_h)
-        new_w = int(orig_w * scale)
-        new_h = int(orig_h * scale)
-        if verbose:
-            print(f"Scaling image from {orig_w}x{orig_h} to {new_w}x{new_h} (scale: {scale:.3f}, mode: {screen_mode})")
-        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LANCZOS4)
-        img = center_crop(img, screen_width, screen_height)
-        if verbose:
-            print(f"Cropped image to {screen_width}x{screen_height}")
+            value = rect_sum(integrals[0], x1, y1, x2, y2) / (rect_area if area is None else area)
+        value = weight * value
+        total = value if total is None else total + value
+    return total
+
+def coarse_to_fine_search(wallpaper, region_width, region_height, x_start, y_start, x_end, y_end, stride, busiest=False, tolerance=0.0, metric="variance", exclude=None):
+    # Stride-1 search that only refines the stride x stride cells of the coarse
+    # lattice that can still beat the best window found so far. Every window
+    # in a cell contains the cell's core (the intersection of all of them) and
+    # lies inside its hull (their union). By the law of total variance,
+    # var(W) >= var(core) * |core| / |W| and var(W) <= var(hull) * |hull| / |W|,
+    # which bounds every window of the cell. Averaged metrics are bounded by
+    # the core and hull sums the same way. With tolerance 0 the result is
+    # exactly the exhaustive stride-1 result, ties included; otherwise it is
+    # within tolerance of it. Returns (None, None) if every window is excluded.
+    terms = wallpaper.metric_terms(metric)
+    exclusion_ii = wallpaper.exclusion_integral(exclude)
+    area = region_width * region_height
+    sign = -1.0 if busiest else 1.0  # minimize sign * variance
+    if stride * stride < 2 * COARSE_TO_FINE_LOOKUP_COST:
+        # Bounding the cells alone would cost about as much as the stride-1 scan
+        stride = 1
+    nx = (x_end - x_start) // stride + 1
+    ny = (y_end - y_start) // stride + 1
+    # Coarse scan: the exact variance at the lattice points (all of them at
+    # stride 1, which is then the exhaustive scan)
+    coarse = sign * metric_grid(terms, x_start, y_start, nx, ny, region_width, region_height, stride)
+    coarse = reject_excluded(coarse, exclusion_ii, x_start, y_start, nx, ny, region_width, region_height, stride)
+    gy, gx = np.unravel_index(np.argmin(coarse), coarse.shape)
+    best = coarse[gy, gx]
+    best_pos = (y_start + gy * stride, x_start + gx * stride)
+    if stride == 1:
+        return ((int(best_pos[1]), int(best_pos[0])), float(sign * best)) if np.isfinite(best) else (None, None)
+    # Bound every cell
+    cx = (x_start + np.arange(nx) * stride)[None, :]
+    cy = (y_start + np.arange(ny) * stride)[:, None]
+    last_x = np.minimum(cx + stride - 1, x_end)
+    last_y = np.minimum(cy + stride - 1, y_end)
+    core_x2, core_y2 = cx + region_width, cy + region_height
+    core_x1, core_y1 = np.minimum(last_x, core_x2), np.minimum(last_y, core_y2)
+    core_area = (core_x2 - core_x1) * (core_y2 - core_y1)
+    if busiest:
+        hull_x2, hull_y2 = last_x + region_width, last_y + region_height
+        bound = -rect_metric(terms, cx, cy, hull_x2, hull_y2, area)
     else:
-        if verbose:
-            print(f"Using original image size: {orig_w}x{orig_h}")
-    arr = img.astype(np.float64)
-    h, w = arr.shape
+        with np.errstate(invalid="ignore", divide="ignore"):
+            bound = rect_metric(terms, core_x1, core_y1, core_x2, core_y2, area)
+        bound = np.where(core_area > 0, bound, 0.0)
+    if exclusion_ii is not None:
+        # Every window of a cell contains its core, so if the core touches the
+        # excluded area the whole cell is out
+        blocked = (core_area > 0) & (rect_sum(exclusion_ii, core_x1, core_y1, core_x2, core_y2) > 0)
+        bound = np.where(blocked, np.inf, bound)
+    bound = bound.ravel()
+    cell_x = np.broadcast_to(cx, (ny, nx)).ravel()
+    cell_y = np.broadcast_to(cy, (ny, nx)).ravel()
+    # Allow for rounding in the variance formula; window sums are exact
+    eps = 1e-6
+    if np.count_nonzero(bound - eps <= best - tolerance) * COARSE_TO_FINE_LOOKUP_COST > bound.size:
+        # Most cells would be refined (smooth wallpapers bound poorly), which
+        # costs more than scanning every position
+        return coarse_to_fine_search(wallpaper, region_width, region_height, x_start, y_start, x_end, y_end, 1, busiest, tolerance, metric, exclude)
+    offsets = np.arange(stride)
+    chunk = max(1, (1 << 20) // (stride * stride))
+    order = np.argsort(bound, kind="stable")
+    for i in range(0, order.size, chunk):
+        cells = order[i:i + chunk]
+        cells = cells[bound[cells] - eps <= best - tolerance]
+        if cells.size == 0:
+            break  # Cells are sorted by bound, the rest can't do better either
+        xs = cell_x[cells][:, None, None] + offsets[None, None, :]
+        ys = cell_y[cells][:, None, None] + offsets[None, :, None]
+        inside = (xs <= x_end) & (ys <= y_end)
+        xs, ys = np.minimum(xs, x_end), np.minimum(ys, y_end)
+        score = sign * rect_metric(terms, xs, ys, xs + region_width, ys + region_height)
+        if exclusion_ii is not None:
+            inside &= rect_sum(exclusion_ii, xs, ys, xs + region_width, ys + region_height) == 0
+        score = np.where(inside, score, np.inf)
+        m = score.min()
+        if m > best or m == np.inf:
+            continue
+        hits = np.nonzero(score == m)
+        hit_y, hit_x = np.broadcast_to(ys, score.shape)[hits], np.broadcast_to(xs, score.shape)[hits]
+        first = np.lexsort((hit_x, hit_y))[0]
+        pos = (int(hit_y[first]), int(hit_x[first]))
+        # Same tie-breaking as the exhaustive scan: first in y-then-x order
+        if m < best or pos < best_pos:
+            best, best_pos = m, pos
+    if not np.isfinite(best):
+        return None, None
+    return (int(best_pos[1]), int(best_pos[0])), float(sign * best)
+
+def windows_under_threshold(terms, exclusion_ii, x_start, y_start, nx, ny, region_width, region_height, stride, threshold, lattices=None):
+    # Windows on the stride lattice whose busyness is at most threshold, as
+    # (gy, gx, value) arrays in row-major order, plus a lower bound on the
+    # busyness of every window. As in coarse_to_fine_search, cells of k x k
+    # lattice points are bounded by their core, and only the windows of cells
+    # that may be under the threshold are looked up. Values match metric_grid.
+    k = int(min(region_width, region_height) * LARGEST_REGION_CELL_SPAN) // stride + 1
+    if k > 1:
+        cell_gx, cell_gy = np.arange(0, nx, k), np.arange(0, ny, k)
+        core_x1 = (x_start + np.minimum(cell_gx + k - 1, nx - 1) * stride)[None, :]
+        core_y1 = (y_start + np.minimum(cell_gy + k - 1, ny - 1) * stride)[:, None]
+        core_x2 = (x_start + cell_gx * stride + region_width)[None, :]
+        core_y2 = (y_start + cell_gy * stride + region_height)[:, None]
+        bound = rect_metric(terms, core_x1, core_y1, core_x2, core_y2, region_width * region_height)
+        if exclusion_ii is not None:
+            bound = np.where(rect_sum(exclusion_ii, core_x1, core_y1, core_x2, core_y2) > 0, np.inf, bound)
+        # Allow for rounding in the variance formula
+        cy, cx = np.nonzero(bound - 1e-6 <= threshold)
+        # Looking up most windows one at a time costs more than the grid
+        if cy.size * k * k * COARSE_TO_FINE_LOOKUP_COST <= nx * ny:
+            offsets = np.arange(k)
+            gy, gx = np.broadcast_arrays(cell_gy[cy][:, None, None] + offsets[None, :, None], cell_gx[cx][:, None, None] + offsets[None, None, :])
+            inside = (gy < ny) & (gx < nx)
+            gy, gx = gy[inside], gx[inside]
+            xs, ys = x_start + gx * stride, y_start + gy * stride
+            value = rect_metric(terms, xs, ys, xs + region_width, ys + region_height)
+            if exclusion_ii is not None:
+                value = np.where(rect_sum(exclusion_ii, xs, ys, xs + region_width, ys + region_height) > 0, np.inf, value)
+            fits = value <= threshold
+            gy, gx, value = gy[fits], gx[fits], value[fits]
+            order = np.lexsort((gx, gy))
+            return gy[order], gx[order], value[order], float(bound.min())
+    # Windows too small to group, or too many cells near the threshold
+    grid = metric_grid(terms, x_start, y_start, nx, ny, region_width, region_height, stride, lattices)
+    grid = reject_excluded(grid, exclusion_ii, x_start, y_start, nx, ny, region_width, region_height, stride, lattices=lattices)
+    # np.nonzero walks the grid in row-major order, i.e. y first, then x
+    gy, gx = np.nonzero(grid <= threshold)
+    return gy, gx, grid[gy, gx], float(grid.min())
+
+def strip_search(gray, region_width, region_height, x_start, y_start, x_end, y_end, stride, busiest=False, strip_rows=LOW_MEMORY_STRIP_ROWS, mask=None):
+    # Exhaustive grayscale variance scan that never builds integral images of
+    # the whole image. Window rows are handled in strips, each with integral
+    # images of just the band of pixel rows it covers. Window sums are exact
+    # integers either way, so the result matches the full scan exactly.
+    # mask: optional exclusion_mask; returns (None, None) if it rules out
+    # every window.
+    nx = (x_end - x_start) // stride + 1
+    ny = (y_end - y_start) // stride + 1
+    grid_rows = max(1, strip_rows // stride)
+    best, best_coords = None, None
+    for gy0 in range(0, ny, grid_rows):
+        gy1 = min(ny, gy0 + grid_rows)
+        top = y_start + gy0 * stride
+        bottom = y_start + (gy1 - 1) * stride + region_height
+        integral, integral_sq = gray_integrals(gray[top:bottom])
+        variance = variance_grid(integral, integral_sq, x_start, 0, nx, gy1 - gy0, region_width, region_height, stride)
+        if mask is not None:
+            band_ii = cv2.integral(mask[top:bottom], sdepth=cv2.CV_32S)
+            variance = reject_excluded(variance, band_ii, x_start, 0, nx, gy1 - gy0, region_width, region_height, stride, busiest)
+        idx = np.argmax(variance) if busiest else np.argmin(variance)
+        gy, gx = np.unravel_index(idx, variance.shape)
+        value = variance[gy, gx]
+        # Strict comparison keeps the first hit in y-then-x order
+        if best is None or (value > best if busiest else value < best):
+            best = value
+            best_coords = (int(x_start + gx * stride), int(top + gy * stride))
+    if not np.isfinite(best):
+        return None, None
+    return best_coords, float(best)
+
+def find_least_busy_region(image_path, region_width=300, region_height=200, screen_width=None, screen_height=None, verbose=False, stride=2, screen_mode="fill", horizontal_padding=50, vertical_padding=50, busiest=False, search="exhaustive", tolerance=0.0, metric="variance", low_memory=False, exclude=None):
+    # exclude: (x, y, w, h) rectangles the region must not intersect. Returns
+    # (coords, variance); coords is None if every position is excluded.
+    wallpaper = load_wallpaper(image_path, screen_width, screen_height, screen_mode, verbose)
+    # Strips only cover the plain grayscale variance of a still image
+    if low_memory and search == "exhaustive" and metric == "variance" and wallpaper.temporal_variance is None:
+        stride = max(1, int(stride) if stride else 1)
+        region_width, region_height, x_start, y_start, x_end, y_end = placement_area(wallpaper, region_width, region_height, horizontal_padding, vertical_padding, verbose)
+        if x_end < x_start or y_end < y_start:
+            return (x_start, y_start), None
+        mask = exclusion_mask(wallpaper.gray.shape, exclude) if exclude else None
+        return strip_search(wallpaper.gray, region_width, region_height, x_start, y_start, x_end, y_end, stride, busiest, mask=mask)
+    if search == "coarse-to-fine":
+        stride = max(1, int(stride) if stride else 1)
+        region_width, region_height, x_start, y_start, x_end, y_end = placement_area(wallpaper, region_width, region_height, horizontal_padding, vertical_padding, verbose)
+        if x_end < x_start or y_end < y_start:
+            return (x_start, y_start), None
+        return coarse_to_fine_search(wallpaper, region_width, region_height, x_start, y_start, x_end, y_end, stride, busiest, tolerance, metric, exclude)
+    variance, x_start, y_start, stride = placement_grid(wallpaper, region_width, region_height, stride, horizontal_padding, vertical_padding, verbose, metric, busiest, exclude)
+    if variance is None:
+        return (x_start, y_start), None
+    # argmin/argmax return the first hit in row-major order, same as a y-then-x scan
+    idx = np.argmax(variance) if busiest else np.argmin(variance)
+    gy, gx = np.unravel_index(idx, variance.shape)
+    if not np.isfinite(variance[gy, gx]):
+        return None, None
+    coords = (int(x_start + gx * stride), int(y_start + gy * stride))
+    return coords, float(variance[gy, gx])
+
+def find_non_overlapping_regions(image_path, sizes, screen_width=None, screen_height=None, verbose=False, stride=2, screen_mode="fill", horizontal_padding=50, vertical_padding=50, busiest=False, metric="variance", exclude=None):
+    # Place several regions so that none of them overlap. Greedy: the largest
+    # region picks its best position first, then every position that would
+    # overlap it is masked out of the grids of the remaining regions.
+    # Returns a (coords, variance) pair per size, in the order given;
+    # (None, None) if a region no longer fits anywhere. Regions also avoid the
+    # exclude rectangles.
+    wallpaper = load_wallpaper(image_path, screen_width, screen_height, screen_mode, verbose)
+    placed = []
+    results = [(None, None)] * len(sizes)
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i][0] * sizes[i][1], reverse=True)
+    for i in order:
+        region_width, region_height = sizes[i]
+        variance, x_start, y_start, grid_stride = placement_grid(wallpaper, region_width, region_height, stride, horizontal_padding, vertical_padding, verbose, metric, busiest, exclude)
+        if variance is None:
+            continue
+        ny, nx = variance.shape
+        taken = np.inf if not busiest else -np.inf
+        for (px, py, pw, ph) in placed:
+            # Windows starting in (px - region_width, px + pw) overlap horizontally
+            gx_lo = max(0, -((x_start - (px - region_width + 1)) // grid_stride))
+            gx_hi = min(nx - 1, (px + pw - 1 - x_start) // grid_stride)
+            gy_lo = max(0, -((y_start - (py - region_height + 1)) // grid_stride))
+            gy_hi = min(ny - 1, (py + ph - 1 - y_start) // grid_stride)
+            if gx_lo <= gx_hi and gy_lo <= gy_hi:
+                variance[gy_lo:gy_hi + 1, gx_lo:gx_hi + 1] = taken
+        idx = np.argmax(variance) if busiest else np.argmin(variance)
+        gy, gx = np.unravel_index(idx, variance.shape)
+        if variance[gy, gx] == taken:
+            if verbose:
+                print(f"No free position left for a {region_width}x{region_height} region")
+            continue
+        coords = (int(x_start + gx * grid_stride), int(y_start + gy * grid_stride))
+        results[i] = (coords, float(variance[gy, gx]))
+        placed.append((coords[0], coords[1], region_width, region_height))
+    return results
+
+def find_largest_region(image_path, screen_width=None, screen_height=None, verbose=False, stride=2, screen_mode="fill", threshold=100.0, aspect_ratio=1.0, horizontal_padding=50, vertical_padding=50, return_candidates=False, metric="variance", exclude=None):
+    wallpaper = load_wallpaper(image_path, screen_width, screen_height, screen_mode, verbose)
+    h, w = wallpaper.gray.shape
     stride = max(1, int(stride) if stride else 1)
     threshold = max(0.0, float(threshold))
     # Adjust padding if image too small
@@ -144,23 +642,14 @@ def find_largest_region(image_path, screen_width=None, screen_height=None, verbo
         horizontal_padding = max(0, min(horizontal_padding, (w - 1) // 2))
         vertical_padding = max(0, min(vertical_padding, (h - 1) // 2))
     # Use OpenCV's integral for fast computation
-    integral = cv2.integral(arr, sdepth=cv2.CV_64F)[1:,1:]
-    integral_sq = cv2.integral(arr**2, sdepth=cv2.CV_64F)[1:,1:]
-    def region_sum(ii, x1, y1, x2, y2):
-        total = ii[y2, x2]
-        if x1 > 0:
-            total -= ii[y2, x1-1]
-        if y1 > 0:
-            total -= ii[y1-1, x2]
-        if x1 > 0 and y1 > 0:
-            total += ii[y1-1, x1-1]
-        return total
+    terms = wallpaper.metric_terms(metric)
+    exclusion_ii = wallpaper.exclusion_integral(exclude)
     min_size = 10
     # Determine maximum feasible size respecting padding
     effective_w = w - 2 * horizontal_padding
     effective_h = h - 2 * vertical_padding
     if effective_w <= 0 or effective_h <= 0:
-        return None, (0, 0), None
+        return (None, (0, 0), None, []) if return_candidates else (None, (0, 0), None)
     # Largest square-ish dimension given aspect ratio and effective space
     if aspect_ratio >= 1.0:
         max_size = min(effective_h, int(effective_w / aspect_ratio))
@@ -169,91 +658,85 @@ def find_largest_region(image_path, screen_width=None, screen_height=None, verbo
     if max_size < min_size:
         min_size = 1
         max_size = max(1, max_size)
-    best = None
-    while min_size <= max_size:
-        mid = (min_size + max_size) // 2
+    def region_dims(size):
         if aspect_ratio >= 1.0:
-            region_h = mid
-            region_w = int(round(mid * aspect_ratio))
-        else:
-            region_w = mid
-            region_h = int(round(mid / aspect_ratio if aspect_ratio != 0 else mid))
+            return int(round(size * aspect_ratio)), size
+        return size, int(round(size / aspect_ratio if aspect_ratio != 0 else size))
+
+    def size_windows(region_w, region_h):
+        nx = (w - region_w - horizontal_padding - x_start) // stride + 1
+        ny = (h - region_h - vertical_padding - y_start) // stride + 1
+        return windows_under_threshold(terms, exclusion_ii, x_start, y_start, nx, ny, region_w, region_h, stride, threshold, lattices)
+
+    # Sweep sizes from largest to smallest, testing every window of a size at
+    # once. Variance is not monotonic in window size, so unlike a binary
+    # search this finds the true largest size with a window under threshold.
+    # Most sizes are ruled out without computing their grid: a window contains
+    # the smaller window at the same corner, so as in coarse_to_fine_search
+    # its busyness is at least the smaller one's scaled by the ratio of their
+    # areas. The least busy window of a probe size somewhat below the current
+    # one thus bounds every size in between. The sizes that are left are
+    # checked with windows_under_threshold, which skips most of their windows.
+    best = None
+    candidates = []
+    lattices = {}
+    x_start = horizontal_padding
+    y_start = vertical_padding
+    # Allow for rounding in the variance formula, as in coarse_to_fine_search
+    eps = 1e-6
+    probe = None  # (size, area, lower bound on the busyness, size_windows result)
+    for size in range(max_size, min_size - 1, -1):
+        region_w, region_h = region_dims(size)
         if region_w <= 0 or region_h <= 0:
-            break
+            continue
         if region_w > effective_w or region_h > effective_h:
-            max_size = mid - 1
             continue
-        found = False
-        x_start = horizontal_padding
-        y_start = vertical_padding
-        x_end = w - region_w - horizontal_padding
-        y_end = h - region_h - vertical_padding
-        for y in range(y_start, y_end + 1, stride):
-            for x in range(x_start, x_end + 1, stride):
-                x1, y1 = x, y
-                x2, y2 = x + region_w - 1, y + region_h - 1
-                if x2 >= w or y2 >= h:
-                    continue
-                s = region_sum(integral, x1, y1, x2, y2)
-                s2 = region_sum(integral_sq, x1, y1, x2, y2)
-                area = region_w * region_h
-                mean = s / area
-                var = (s2 / area) - (mean ** 2)
-                if var <= threshold:
-                    found = True
-                    best = (x, y, region_w, region_h, var)
-                    break
-            if found:
-                break
-        if found:
-            min_size = mid + 1
+        if probe is None or size < probe[0]:
+            probe_size = max(min_size, int(size * LARGEST_REGION_PROBE_RATIO))
+            if probe is not None and probe[2] > threshold and min(region_dims(probe_size)) * LARGEST_REGION_CELL_SPAN < stride:
+                # Windows this small need a whole grid per probe. Where
+                # busyness doesn't drop with size, as on noisy wallpapers, a
+                # probe covers sizes up to sqrt(bound / threshold) times its
+                # own, so go that far down at once.
+                probe_size = max(min_size, min(probe_size, int(size * 1.5 * (threshold / probe[2]) ** 0.5)))
+            probe_w, probe_h = region_dims(probe_size)
+            if probe_w > 0 and probe_h > 0:
+                probe_windows = size_windows(probe_w, probe_h)
+                probe = (probe_size, probe_w * probe_h, probe_windows[3], probe_windows)
+            else:
+                probe = (size, 0, 0.0, None)
+        if size == probe[0] and probe[3] is not None:
+            gys, gxs, values, _ = probe[3]
+        elif probe[2] * probe[1] / (region_w * region_h) - eps > threshold:
+            continue
         else:
-            max_size = mid - 1
+            gys, gxs, values, _ = size_windows(region_w, region_h)
+        for gy, gx, value in zip(gys.tolist(), gxs.tolist(), values.tolist()):
+            x = x_start + gx * stride
+            y = y_start + gy * stride
+            candidates.append((x + region_w // 2, y + region_h // 2, region_w, region_h, value))
+        if not candidates:
+            continue
+        best = candidates[0]
+        if verbose:
+            print(f"Largest region under threshold: {region_w}x{region_h} ({len(candidates)} candidates)")
+        break
     if best:
-        x, y, region_w, region_h, var = best
-        center_x = x + region_w // 2
-        center_y = y + region_h // 2
-        return (center_x, center_y), (region_w, region_h), var
+        center_x, center_y, region_w, region_h, var = best
+        result = (center_x, center_y), (region_w, region_h), var
     else:
-        return None, (0, 0), None
+        result = None, (0, 0), None
+    return (*result, candidates) if return_candidates else result
 
 def draw_region(image_path, coords, region_width=300, region_height=200, output_path='output.png', screen_width=None, screen_height=None, screen_mode="fill"):
-    img = cv2.imread(image_path)
-    if img is None:
-        raise FileNotFoundError(f"Image not found: {image_path}")
-    orig_h, orig_w = img.shape[:2]
-    if screen_width is not None and screen_height is not None:
-        scale_w = screen_width / orig_w
-        scale_h = screen_height / orig_h
-        if screen_mode == "fill":
-            scale = max(scale_w, scale_h)
-        else:
-            scale = min(scale_w, scale_h)
-        new_w = int(orig_w * scale)
-        new_h = int(orig_h * scale)
-        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LANCZOS4)
-        img = center_crop(img, screen_width, screen_height)
+    img = load_wallpaper(image_path, screen_width, screen_height, screen_mode).bgr.copy()
     x, y = coords
     cv2.rectangle(img, (x, y), (x+region_width-1, y+region_height-1), (0,0,255), 3)
     cv2.imwrite(output_path, img)
     # print removed for quieter operation
 
 def draw_largest_region(image_path, center, size, output_path='output.png', screen_width=None, screen_height=None, screen_mode="fill"):
-    img = cv2.imread(image_path)
-    if img is None:
-        raise FileNotFoundError(f"Image not found: {image_path}")
-    orig_h, orig_w = img.shape[:2]
-    if screen_width is not None and screen_height is not None:
-        scale_w = screen_width / orig_w
-        scale_h = screen_height / orig_h
-        if screen_mode == "fill":
-            scale = max(scale_w, scale_h)
-        else:
-            scale = min(scale_w, scale_h)
-        new_w = int(orig_w * scale)
-        new_h = int(orig_h * scale)
-        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LANCZOS4)
-        img = center_crop(img, screen_width, screen_height)
+    img = load_wallpaper(image_path, screen_width, screen_height, screen_mode).bgr.copy()
     cx, cy = center
     region_w, region_h = size
     x1 = cx - region_w // 2
@@ -264,22 +747,8 @@ def draw_largest_region(image_path, center, size, output_path='output.png', scre
     cv2.imwrite(output_path, img)
     # print removed for quieter operation
 
-def get_dominant_color(image_path, x, y, w, h, screen_width=None, screen_height=None, screen_mode="fill"):
-    img = cv2.imread(image_path)
-    if img is None:
-        raise FileNotFoundError(f"Image not found: {image_path}")
-    orig_h, orig_w = img.shape[:2]
-    if screen_width is not None and screen_height is not None:
-        scale_w = screen_width / orig_w
-        scale_h = screen_height / orig_h
-        if screen_mode == "fill":
-            scale = max(scale_w, scale_h)
-        else:
-            scale = min(scale_w, scale_h)
-        new_w = int(orig_w * scale)
-        new_h = int(orig_h * scale)
-        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LANCZOS4)
-        img = center_crop(img, screen_width, screen_height)
+def get_dominant_color(image_path, x, y, w, h, screen_width=None, screen_height=None, screen_mode="fill", method="histogram"):
+    img = load_wallpaper(image_path, screen_width, screen_height, screen_mode).bgr
     # Ensure region is within bounds
     x = max(0, x)
     y = max(0, y)
@@ -288,32 +757,123 @@ def get_dominant_color(image_path, x, y, w, h, screen_width=None, screen_height=
     region = img[y:y+h, x:x+w]
     if region.size == 0 or region.shape[0] == 0 or region.shape[1] == 0:
         return [0, 0, 0]
+    if method != "kmeans":
+        # Regularly spaced subsample so the cost doesn't grow with the region
+        step = max(1, int(np.ceil(np.sqrt(region.shape[0] * region.shape[1] / DOMINANT_COLOR_SAMPLES))))
+        region = region[::step, ::step]
     region = region.reshape((-1, 3))
     # Filter out black pixels (optional, improves accuracy for some images)
     non_black = region[np.any(region > 10, axis=1)]
     if non_black.shape[0] == 0:
         non_black = region
-    region = np.float32(non_black)
+    if method == "kmeans":
+        dominant = dominant_color_kmeans(non_black)
+    else:
+        dominant = dominant_color_histogram(non_black, polish=(method == "histogram-kmeans"))
+    # Reverse from BGR to RGB
+    return [int(x) for x in reversed(dominant)]
+
+def dominant_color_histogram(pixels, polish=False, bits=4, clusters=3, iterations=5):
+    # Most populated cell of a coarse 3D color histogram, as the mean of the
+    # pixels in it. Ties go to the lowest cell index, so this is deterministic.
+    # With polish, a few k-means iterations seeded from the top cells refine it.
+    shift = 8 - bits
+    q = (pixels >> shift).astype(np.intp)
+    cells = (q[:, 0] << (2 * bits)) | (q[:, 1] << bits) | q[:, 2]
+    counts = np.bincount(cells, minlength=1 << (3 * bits))
+    sums = np.stack([np.bincount(cells, weights=pixels[:, c], minlength=counts.size) for c in range(3)], axis=1)
+    peaks = np.argsort(-counts, kind="stable")[:clusters]
+    peaks = peaks[counts[peaks] > 0]
+    centers = sums[peaks] / counts[peaks, None]
+    if not polish or len(peaks) < 2:
+        return centers[0]
+    data = pixels.astype(np.float32)
+    for _ in range(iterations):
+        dist = ((data[:, None, :] - centers[None, :, :].astype(np.float32)) ** 2).sum(axis=2)
+        labels = np.argmin(dist, axis=1)
+        sizes = np.bincount(labels, minlength=len(centers))
+        for k in range(len(centers)):
+            if sizes[k] > 0:
+                centers[k] = data[labels == k].mean(axis=0)
+    return centers[np.argmax(sizes)]
+
+def dominant_color_kmeans(pixels):
+    region = np.float32(pixels)
     if region.shape[0] < 3:
-        return [int(x) for x in np.mean(region, axis=0)]
+        return np.mean(region, axis=0)
     # K-means to find dominant color
     criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
     K = min(3, region.shape[0])
     _, labels, centers = cv2.kmeans(region, K, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
     counts = np.bincount(labels.flatten())
-    dominant = centers[np.argmax(counts)]
-    # Reverse from BGR to RGB
-    return [int(x) for x in reversed(dominant)]
+    return centers[np.argmax(counts)]
+
+def cache_file():
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(cache_home, "quickshell", "least_busy_region", "results.json")
+
+def cache_key(args):
+    # Identify the wallpaper by path, size and mtime, plus every argument that
+    # can change the output. Returns None if the file can't be stat'ed.
+    try:
+        st = os.stat(args.image_path)
+    except OSError:
+        return None
+    params = {k: v for k, v in sorted(vars(args).items()) if k not in CACHE_IGNORED_ARGS}
+    identity = [CACHE_VERSION, os.path.realpath(args.image_path), st.st_size, st.st_mtime_ns, params]
+    return hashlib.sha1(json.dumps(identity, sort_keys=True).encode()).hexdigest()
+
+def cache_read_entries():
+    try:
+        with open(cache_file(), "r") as f:
+            entries = json.load(f)
+        return entries if isinstance(entries, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def cache_write_entries(entries):
+    path = cache_file()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+def cache_load(key):
+    entries = cache_read_entries()
+    result = entries.pop(key, None)
+    if result is not None:
+        # Move to the end to mark as most recently used
+        entries[key] = result
+        cache_write_entries(entries)
+    return result
+
+def cache_store(key, result, max_entries=DEFAULT_CACHE_SIZE):
+    entries = cache_read_entries()
+    entries.pop(key, None)
+    entries[key] = result
+    # Dicts keep insertion order, so the least recently used entries come first
+    while len(entries) > max(0, max_entries):
+        del entries[next(iter(entries))]
+    cache_write_entries(entries)
 
 def main():
     parser = argparse.ArgumentParser(description="Find least busy region in an image and output a JSON. Made for determining a suitable position for a wallpaper widget.")
-    parser.add_argument("image_path", help="Path to the input image")
+    parser.add_argument("image_path", help="Path to the input image or video")
+    parser.add_argument("--video-frames", type=int, default=DEFAULT_VIDEO_FRAMES, help=f"Frames to sample from a video wallpaper (default: {DEFAULT_VIDEO_FRAMES}). Busyness then includes change over time")
     parser.add_argument("--width", type=int, default=300, help="Region width")
     parser.add_argument("--height", type=int, default=200, help="Region height")
     parser.add_argument("-v", "--visual-output", action="store_true", help="Output image with rectangle")
     parser.add_argument("--screen-width", type=int, default=1920, help="Screen width for wallpaper scaling")
     parser.add_argument("--screen-height", type=int, default=1080, help="Screen height for wallpaper scaling")
     parser.add_argument("--stride", type=int, default=10, help="Step size for sliding window (higher is faster, less precise)")
+    parser.add_argument("--metric", default="variance", help="Busyness metric: 'variance' (default, grayscale variance), 'gradient' (Sobel gradient energy), 'edges' (Canny edge density), 'lab' (summed Lab channel variances), or a weighted mix like 'variance:1,edges:0.5'. Reported as \"variance\" in the output")
+    parser.add_argument("--low-memory", action="store_true", help="Bound memory use for very large wallpapers: scan window rows in strips instead of building whole-image grids. Results are identical. Not available with --largest-region, whose size sweep needs whole-image integral images")
+    parser.add_argument("--search-strategy", choices=["exhaustive", "coarse-to-fine"], default="exhaustive", help="'exhaustive' (default) checks every position on the stride lattice; 'coarse-to-fine' scans at --stride, then refines at stride 1 only where the result can still improve, or scans every position when that's cheaper (small strides, smooth wallpapers)")
+    parser.add_argument("--search-tolerance", type=float, default=0.0, help="Coarse-to-fine only: accept a result at most this much worse than the exhaustive stride-1 one (default: 0, exact)")
     parser.add_argument("--screen-mode", choices=["fill", "fit"], default="fill", help="Wallpaper scaling mode: 'fill' (default) or 'fit'")
     parser.add_argument("--verbose", action="store_true", help="Print verbose output")
     parser.add_argument("-l", "--largest-region", action="store_true", help="Find the largest region under the variance threshold and output its center")
@@ -322,11 +882,135 @@ def main():
     parser.add_argument("--horizontal-padding", "-hp", type=int, default=50, help="Minimum horizontal distance from region to image edge")
     parser.add_argument("--vertical-padding", "-vp", type=int, default=50, help="Minimum vertical distance from region to image edge")
     parser.add_argument("--busiest", action="store_true", help="Find the busiest region instead of the least busy")
+    parser.add_argument("--exclude", action="append", default=[], metavar="X,Y,W,H", help="Rectangle the region must not intersect, e.g. a bar or another widget, in screen coordinates (can be repeated)")
+    parser.add_argument("--color-method", choices=["histogram", "histogram-kmeans", "kmeans"], default="histogram", help="Dominant color extraction: 'histogram' (default, peak of a coarse color histogram), 'histogram-kmeans' (histogram peaks polished with k-means), or 'kmeans' (random-start k-means over the whole region, not deterministic)")
+    parser.add_argument("--multi", nargs="+", metavar="WxH", help="Place several regions of the given sizes without overlap and output a JSON array, one entry per size")
+    parser.add_argument("--candidates", action="store_true", help="In largest region mode, also list every window of the largest size that is under the threshold")
+    parser.add_argument("--batch", action="store_true", help="Read a JSON array of queries from stdin and output a JSON array of results in the same order")
+    parser.add_argument("--query", action="append", default=[], help="Add a JSON object query to the batch (can be repeated). Keys are long option names, e.g. {\"screen_width\": 2560, \"width\": 400}")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore and don't update the on-disk result cache")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE, help=f"Maximum number of cached results (default: {DEFAULT_CACHE_SIZE})")
+    parser.add_argument("--export-map", metavar="PATH", help="Write a busyness map of the scaled wallpaper to PATH instead of searching. Query it with busyness_map.py")
+    parser.add_argument("--map-block", type=int, default=DEFAULT_MAP_BLOCK, help=f"Cell size in pixels of the exported map (default: {DEFAULT_MAP_BLOCK}). 1 gives exact answers at 16 bytes per pixel")
     args = parser.parse_args()
+    if args.largest_region and args.low_memory:
+        parser.error("--low-memory can't be combined with --largest-region")
+    try:
+        parse_metric(args.metric)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.export_map:
+        import_compute_modules()
+        wallpaper = PreparedWallpaper(args.image_path, args.screen_width, args.screen_height, args.screen_mode, args.verbose, video_frames=args.video_frames)
+        write_busyness_map(args.export_map, wallpaper.gray, args.map_block)
+        h, w = wallpaper.gray.shape
+        print(json.dumps({"map": args.export_map, "width": w, "height": h, "block": max(1, args.map_block)}))
+        return
+
+    if args.batch or args.query:
+        queries = [json.loads(q) for q in args.query]
+        if args.batch:
+            queries.extend(json.load(sys.stdin))
+        print(json.dumps(run_batch(args, queries)))
+        return
+
+    # Visual output needs the decoded image anyway, so don't bother with the cache
+    use_cache = not args.no_cache and not args.visual_output
+    key = cache_key(args) if use_cache else None
+    if key is not None:
+        result = cache_load(key)
+        if result is not None:
+            print(json.dumps(result))
+            return
+
+    # Decode, scale and crop once; every stage below reuses this
+    import_compute_modules()
+    wallpaper = PreparedWallpaper(args.image_path, args.screen_width, args.screen_height, args.screen_mode, args.verbose, video_frames=args.video_frames)
+    result = run_query(wallpaper, args)
+    if key is not None:
+        cache_store(key, result, args.cache_size)
+    print(json.dumps(result))
+
+def query_args(args, query):
+    # Overlay one batch query on top of the command line arguments. Keys are
+    # long option names, with either dashes or underscores.
+    values = vars(args).copy()
+    for key, value in query.items():
+        name = key.lstrip("-").replace("-", "_")
+        if name not in values or name in QUERY_FIXED_ARGS:
+            raise ValueError(f"Unknown query option: {key}")
+        values[name] = value
+    if values["largest_region"] and values["low_memory"]:
+        raise ValueError("low_memory can't be combined with largest_region")
+    return argparse.Namespace(**values)
+
+def run_batch(args, queries):
+    # Queries sharing a screen geometry share one scaled image and its integral
+    # images. The wallpaper itself is decoded at most once in color and once
+    # in grayscale.
+    queries = [query_args(args, q) for q in queries]
+    results = [None] * len(queries)
+    keys = [None] * len(queries)
+    groups = {}
+    for i, q in enumerate(queries):
+        if not args.no_cache and not q.visual_output:
+            keys[i] = cache_key(q)
+            if keys[i] is not None:
+                results[i] = cache_load(keys[i])
+                if results[i] is not None:
+                    continue
+        groups.setdefault((q.screen_width, q.screen_height, q.screen_mode), []).append(i)
+    if groups:
+        import_compute_modules()
+    decoded = {}
+    for (screen_width, screen_height, screen_mode), indices in groups.items():
+        # Videos are streamed again for each geometry, keeping memory bounded
+        wallpaper = PreparedWallpaper(args.image_path, screen_width, screen_height, screen_mode, args.verbose, decoded=decoded, video_frames=args.video_frames)
+        for i in indices:
+            results[i] = run_query(wallpaper, queries[i])
+            if keys[i] is not None:
+                cache_store(keys[i], results[i], args.cache_size)
+    return results
+
+def parse_size(size):
+    w, h = size.lower().split("x")
+    return int(w), int(h)
+
+def run_query(wallpaper, args):
+    exclude = [parse_rect(rect) for rect in args.exclude]
+    if args.multi:
+        sizes = [parse_size(size) for size in args.multi]
+        placements = find_non_overlapping_regions(
+            wallpaper,
+            sizes,
+            verbose=args.verbose,
+            stride=args.stride,
+            horizontal_padding=args.horizontal_padding,
+            vertical_padding=args.vertical_padding,
+            busiest=args.busiest,
+            metric=args.metric,
+            exclude=exclude
+        )
+        results = []
+        for (region_w, region_h), (coords, variance) in zip(sizes, placements):
+            if coords is None:
+                results.append({"error": "No free region found."})
+                continue
+            dominant_color = get_dominant_color(wallpaper, coords[0], coords[1], region_w, region_h, method=args.color_method)
+            results.append({
+                "center_x": coords[0] + region_w // 2,
+                "center_y": coords[1] + region_h // 2,
+                "width": region_w,
+                "height": region_h,
+                "variance": variance,
+                "dominant_color": '#{:02x}{:02x}{:02x}'.format(*dominant_color)
+            })
+        return results
 
     if args.largest_region:
-        center, size, var = find_largest_region(
-            args.image_path,
+        center, size, var, candidates = find_largest_region(
+            wallpaper,
             screen_width=args.screen_width,
             screen_height=args.screen_height,
             verbose=args.verbose,
@@ -335,35 +1019,43 @@ def main():
             threshold=args.variance_threshold,
             aspect_ratio=args.aspect_ratio,
             horizontal_padding=args.horizontal_padding,
-            vertical_padding=args.vertical_padding
+            vertical_padding=args.vertical_padding,
+            return_candidates=True,
+            metric=args.metric,
+            exclude=exclude
         )
-        if center:
-            if args.visual_output:
-                draw_largest_region(args.image_path, center, size, screen_width=args.screen_width, screen_height=args.screen_height, screen_mode=args.screen_mode)
-            # Extract dominant color
-            cx, cy = center
-            region_w, region_h = size
-            x1 = cx - region_w // 2
-            y1 = cy - region_h // 2
-            dominant_color = get_dominant_color(
-                args.image_path, x1, y1, region_w, region_h,
-                screen_width=args.screen_width, screen_height=args.screen_height, screen_mode=args.screen_mode
-            )
-            dominant_color_hex = '#{:02x}{:02x}{:02x}'.format(*dominant_color)
-            print(json.dumps({
-                "center_x": center[0],
-                "center_y": center[1],
-                "width": size[0],
-                "height": size[1],
-                "variance": var,
-                "dominant_color": dominant_color_hex
-            }))
-        else:
-            print(json.dumps({"error": "No region found under the threshold."}))
-        return
+        if not center:
+            return {"error": "No region found under the threshold."}
+        if args.visual_output:
+            draw_largest_region(wallpaper, center, size, screen_width=args.screen_width, screen_height=args.screen_height, screen_mode=args.screen_mode)
+        # Extract dominant color
+        cx, cy = center
+        region_w, region_h = size
+        x1 = cx - region_w // 2
+        y1 = cy - region_h // 2
+        dominant_color = get_dominant_color(
+            wallpaper, x1, y1, region_w, region_h,
+            screen_width=args.screen_width, screen_height=args.screen_height, screen_mode=args.screen_mode,
+            method=args.color_method
+        )
+        dominant_color_hex = '#{:02x}{:02x}{:02x}'.format(*dominant_color)
+        result = {
+            "center_x": center[0],
+            "center_y": center[1],
+            "width": size[0],
+            "height": size[1],
+            "variance": var,
+            "dominant_color": dominant_color_hex
+        }
+        if args.candidates:
+            result["candidates"] = [
+                {"center_x": c[0], "center_y": c[1], "width": c[2], "height": c[3], "variance": c[4]}
+                for c in candidates
+            ]
+        return result
 
     coords, variance = find_least_busy_region(
-        args.image_path,
+        wallpaper,
         region_width=args.width,
         region_height=args.height,
         screen_width=args.screen_width,
@@ -373,27 +1065,34 @@ def main():
         screen_mode=args.screen_mode,
         horizontal_padding=args.horizontal_padding,
         vertical_padding=args.vertical_padding,
-        busiest=args.busiest
+        busiest=args.busiest,
+        search=args.search_strategy,
+        tolerance=args.search_tolerance,
+        metric=args.metric,
+        low_memory=args.low_memory,
+        exclude=exclude
     )
+    if coords is None:
+        return {"error": "No region found outside the excluded areas."}
     if args.visual_output:
-        draw_region(args.image_path, coords, region_width=args.width, region_height=args.height, screen_width=args.screen_width, screen_height=args.screen_height, screen_mode=args.screen_mode)
+        draw_region(wallpaper, coords, region_width=args.width, region_height=args.height, screen_width=args.screen_width, screen_height=args.screen_height, screen_mode=args.screen_mode)
     # Output JSON with center point
     center_x = coords[0] + args.width // 2
     center_y = coords[1] + args.height // 2
     dominant_color = get_dominant_color(
-        args.image_path, coords[0], coords[1], args.width, args.height,
-        screen_width=args.screen_width, screen_height=args.screen_height, screen_mode=args.screen_mode
+        wallpaper, coords[0], coords[1], args.width, args.height,
+        screen_width=args.screen_width, screen_height=args.screen_height, screen_mode=args.screen_mode,
+        method=args.color_method
     )
     dominant_color_hex = '#{:02x}{:02x}{:02x}'.format(*dominant_color)
-    print(json.dumps({
+    return {
         "center_x": center_x,
         "center_y": center_y,
         "width": args.width,
         "height": args.height,
         "variance": variance,
         "dominant_color": dominant_color_hex
-    }))
+    }
 
 if __name__ == "__main__":
     main()
-
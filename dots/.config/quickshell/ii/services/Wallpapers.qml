@@ -17,6 +17,7 @@ Singleton {
 
     property string thumbgenScriptPath: `${FileUtils.trimFileProtocol(Directories.scriptPath)}/thumbnails/thumbgen-venv.sh`
     property string generateThumbnailsMagickScriptPath: `${FileUtils.trimFileProtocol(Directories.scriptPath)}/thumbnails/generate-thumbnails-magick.sh`
+    property string wallpaperIndexScriptPath: `${FileUtils.trimFileProtocol(Directories.scriptPath)}/colors/wallpaper_index.py`
     property alias directory: folderModel.folder
     readonly property string effectiveDirectory: FileUtils.trimFileProtocol(folderModel.folder.toString())
     property url defaultFolder: Qt.resolvedUrl(`${Directories.pictures}/Wallpapers`)
@@ -179,9 +180,20 @@ Singleton {
         onExited: (exitCode, exitStatus) => {
             // print("[Wallpapers] Thumbnail generation completed with exit code", exitCode)
             root.thumbnailGenerated(thumbgenProc.directory)
+            root.updateWallpaperIndex()
         }
     }
 
+    // Seed color and scheme index that switchwall.sh reads, so switching skips image analysis
+    function updateWallpaperIndex() {
+        wallpaperIndexProc.running = false
+        wallpaperIndexProc.command = [wallpaperIndexScriptPath, "-d", root.effectiveDirectory]
+        wallpaperIndexProc.running = true
+    }
+    Process {
+        id: wallpaperIndexProc
+    }
+
     IpcHandler {
         target: "wallpapers"
 